@@ -7,6 +7,8 @@ Created on Thu Sep  7 22:21:44 2017
 Tools for managing data
 """
 
+import os
+import _pickle
 import numpy as np
 
 #%%============================================================================
@@ -15,7 +17,10 @@ import numpy as np
 
 def get_cv_idxs(idxs, kcv, n_shuffles):
 
-    """Get K-fold cross validation indices"""
+    """
+    Get K-fold cross validation indices. Returns lists of training and
+    testing indices (int32 np arrays), one per fold of each shuffle.
+    """
 
     #
     # indices of cross validation for each fold
@@ -29,16 +34,15 @@ def get_cv_idxs(idxs, kcv, n_shuffles):
     
     fold_bounds = np.int64(fold_bounds)
     
-    fold_cv_test = list(np.zeros(kcv * n_shuffles))
-    fold_cv_train = list(np.zeros(kcv * n_shuffles))
-    
+    fold_cv_test = []
+    fold_cv_train = []
     
     # Doing all the shufling first since for some reason
     # np shuffle does not work insider the next loop!
     idx_shuffles = list(np.zeros(n_shuffles))
     for shuff in range(n_shuffles):
         np.random.shuffle(idxs)
-        idx_shuffles[shuff] = idxs.copy()
+        idx_shuffles[shuff] = np.array(idxs, dtype=np.int32)
 
     #    
     # K-fold cross-validation with shuffles
@@ -49,14 +53,109 @@ def get_cv_idxs(idxs, kcv, n_shuffles):
         
         # Cycle through folds and get indices
         for k in(range(kcv)):
-            fold_cv_test[S * kcv + k] = \
-                list(ThisIdxList[fold_bounds[k] : fold_bounds[k+1]])
-            fold_cv_train[S * kcv + k] = \
-                [j for j in ThisIdxList if j not in fold_cv_test[S * kcv + k]]
+            is_test = np.zeros(N_cv, dtype=bool)
+            is_test[fold_bounds[k] : fold_bounds[k+1]] = True
+            fold_cv_test.append(ThisIdxList[is_test])
+            fold_cv_train.append(ThisIdxList[~is_test])
 
     return fold_cv_train, fold_cv_test
 
 
+#%%============================================================================
+# Lazy, seeded cross validation folds
+#==============================================================================
+
+class CVFolds(object):
+
+    """
+    K-fold cross validation indices with shuffles, generated lazily. 
+    Each shuffle is a permutation drawn from its own generator, 
+    np.random.default_rng([seed, shuffle]), so fold i (of shuffle 
+    i // kcv) can be made directly, without the global np.random state 
+    or the other folds - eg. parallel workers can each regenerate 
+    their own folds from (N, kcv, n_shuffles, seed).
+
+    Folds are of (nearly) equal size. If categories are given 
+    (eg. censorship), each category is split into folds separately, so 
+    that folds have nearly equal representations of each category.
+
+    Example:
+    --------
+    folds = CVFolds(N, kcv=5, n_shuffles=6, seed=0, categories=Censored)
+    for train, test in folds:
+        ...
+    train, test = folds[7]
+    """
+
+    def __init__(self, N, kcv=5, n_shuffles=1, seed=0, categories=None):
+
+        """
+        Args:
+        -----
+        N - no of samples
+        kcv - K-fold cross validation
+        n_shuffles - no of shuffles
+        seed - random seed
+        categories - (N,) np array of category per sample, or None
+        """
+
+        if categories is not None:
+            assert len(categories) == N
+
+        self.N = N
+        self.kcv = kcv
+        self.n_shuffles = n_shuffles
+        self.seed = seed
+        self.categories = categories
+
+    #==========================================================================
+
+    def __len__(self):
+        return self.kcv * self.n_shuffles
+
+    #==========================================================================
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    #==========================================================================
+
+    def __getitem__(self, i):
+
+        """
+        Training and testing indices (int32 np arrays) of fold i, 
+        where folds of each shuffle are consecutive.
+        """
+
+        if not 0 <= i < len(self):
+            raise IndexError("fold index out of range")
+
+        shuffle, k = divmod(i, self.kcv)
+        rng = np.random.default_rng([self.seed, shuffle])
+
+        if self.categories is None:
+            groups = [np.arange(self.N)]
+        else:
+            categories = np.asarray(self.categories)
+            groups = [np.nonzero(categories == c)[0] \
+                      for c in np.unique(categories)]
+
+        # permute each group and take its kth fold
+        is_test = np.zeros(self.N, dtype=bool)
+        test = []
+        for group in groups:
+            group = rng.permutation(group)
+            bounds = (np.arange(self.kcv + 1) * len(group)) // self.kcv
+            test.append(group[bounds[k] : bounds[k+1]])
+            is_test[test[-1]] = True
+
+        test = np.int32(np.concatenate(test))
+        train = np.int32(np.nonzero(~is_test)[0])
+
+        return train, test
+
+
 #%%============================================================================
 #  Cross validation with shuffling, including a validation set
 #==============================================================================
@@ -135,7 +234,8 @@ def getSplitIdxs(N, OFFSET = 0,
             
             # append optimization indices to training set
             for f in range(len(train)):
-                train[f] += optimization_idxs[fold_no]
+                train[f] = np.concatenate((train[f], 
+                                           optimization_idxs[fold_no]))
         else:
             train, test = \
                 get_cv_idxs(idx_all, K, n_shuffles=SHUFFLES)   
@@ -180,7 +280,7 @@ def get_balanced_SplitIdxs(categories,
         
         # isolate category and get its offset
         category = categories[:, 1] == category_identifier
-        offset = list(np.cumsum(category)).index(1)
+        offset = np.argmax(category)
         N_categ = np.sum(category)
         
         # Get optimization set and K-fold CV indices
@@ -203,15 +303,19 @@ def get_balanced_SplitIdxs(categories,
         category_identifier = unique_categories[c]
         SplitIdxs_thiscateg = _get_category_SplitIdx(categories, category_identifier)
         
-        # merge with existing lists of indices
+        # merge with existing arrays of indices
         n_folds = len(SplitIdxs_thiscateg['fold_cv_train'])
         for fold in range(n_folds):
             if USE_OPTIM > 0:
-                SplitIdxs['idx_optim'][fold] += SplitIdxs_thiscateg['idx_optim'][fold]
+                SplitIdxs['idx_optim'][fold] = np.concatenate(\
+                    (SplitIdxs['idx_optim'][fold], 
+                     SplitIdxs_thiscateg['idx_optim'][fold]))
 
             for k in range(K * SHUFFLES):
-                SplitIdxs['fold_cv_train'][fold][k] += SplitIdxs_thiscateg['fold_cv_train'][fold][k]
-                SplitIdxs['fold_cv_test'][fold][k] += SplitIdxs_thiscateg['fold_cv_test'][fold][k]
+                for key in ['fold_cv_train', 'fold_cv_test']:
+                    SplitIdxs[key][fold][k] = np.concatenate(\
+                        (SplitIdxs[key][fold][k], 
+                         SplitIdxs_thiscateg[key][fold][k]))
         
     return SplitIdxs
 
@@ -232,6 +336,142 @@ def get_balanced_batches(categories, BATCH_SIZE):
     batchIdxs = batchIdxs['fold_cv_test'][0][0:K]
     
     return batchIdxs
+
+#==============================================================================
+
+class StratifiedBatchSampler(object):
+
+    """
+    Balanced batches (to be used for stochastic GD), like 
+    get_balanced_batches, but with the index pools of each category 
+    found once; every epoch each pool is permuted and dealt into the 
+    batches in O(N). Batches are int32 index arrays, so data are only 
+    gathered per batch (no reshuffling of whole matrices).
+
+    Example:
+    --------
+    sampler = StratifiedBatchSampler(censored, BATCH_SIZE=20)
+    for epoch in range(n_epochs):
+        for batch in sampler:
+            x_batch = features[batch, :]
+    """
+
+    def __init__(self, categories, BATCH_SIZE, seed=None):
+
+        """
+        Args:
+        -----
+        categories - (N,) np array of category per sample 
+                     (eg. 1 == censored patient)
+        BATCH_SIZE - (approximate) no of samples per batch
+        seed - random seed; if None, it is drawn from the global 
+               np.random state (so np.random.seed still applies)
+        """
+
+        categories = np.asarray(categories)
+        
+        self.n_batches = max(1, int(categories.shape[0] / BATCH_SIZE))
+        self.pools = [np.int32(np.nonzero(categories == c)[0]) \
+                      for c in np.unique(categories)]
+
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - 1)
+        self.rng = np.random.default_rng(seed)
+
+    #==========================================================================
+
+    def __len__(self):
+        return self.n_batches
+
+    #==========================================================================
+
+    def __iter__(self):
+        return iter(self.sample())
+
+    #==========================================================================
+
+    def sample(self):
+
+        """ List of batches (int32 np arrays) for one epoch"""
+
+        parts = []
+        for pool in self.pools:
+            pool = self.rng.permutation(pool)
+            bounds = (np.arange(self.n_batches + 1) * len(pool)) // \
+                     self.n_batches
+            parts.append([pool[bounds[b] : bounds[b+1]] \
+                          for b in range(self.n_batches)])
+
+        return [np.concatenate([part[b] for part in parts]) \
+                for b in range(self.n_batches)]
+
+#%%============================================================================
+# Saving and loading split indices
+#==============================================================================
+
+def save_split_idxs(splitIdxs, path):
+
+    """
+    Saves split indices (dict of possibly nested lists of index 
+    arrays) to a compressed .npz file, with one array per fold under 
+    keys like 'fold_cv_train/0/3'.
+    """
+
+    arrays = {}
+
+    def _flatten(obj, key):
+        if isinstance(obj, dict):
+            for k in obj.keys():
+                _flatten(obj[k], key + [str(k)])
+        elif isinstance(obj, (list, tuple)):
+            for i, item in enumerate(obj):
+                _flatten(item, key + [str(i)])
+        else:
+            arrays['/'.join(key)] = np.int32(obj)
+
+    _flatten(splitIdxs, [])
+    np.savez_compressed(path, **arrays)
+
+#==============================================================================
+
+def load_split_idxs(path):
+
+    """
+    Loads split indices saved by save_split_idxs or pickled (older 
+    split files). If path does not exist, path + '.npz' then 
+    path + '.pkl' are tried.
+    """
+
+    if not os.path.exists(path):
+        for ext in ['.npz', '.pkl']:
+            if os.path.exists(path + ext):
+                path = path + ext
+                break
+
+    if not path.endswith('.npz'):
+        with open(path, 'rb') as f:
+            return _pickle.load(f)
+
+    splitIdxs = {}
+    with np.load(path) as arrays:
+        for name in arrays.files:
+
+            key = name.split('/')
+            if len(key) == 1:
+                splitIdxs[name] = arrays[name]
+                continue
+
+            # walk down nested lists (eg. outer then inner folds)
+            obj = splitIdxs.setdefault(key[0], [])
+            for i in key[1:-1]:
+                obj.extend([[] for _ in range(int(i) + 1 - len(obj))])
+                obj = obj[int(i)]
+
+            i = int(key[-1])
+            obj.extend([None] * (i + 1 - len(obj)))
+            obj[i] = arrays[name]
+
+    return splitIdxs
     
     
 #%%############################################################################
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Optional compiled (numba) kernels for the loops over patients / pairs
+of patients. Kernels are written as plain python functions and compiled
+with numba when it is installed; callers only use them when USE_NUMBA
+is True and otherwise fall back to their numpy code.
+
+Set USE_NUMBA = False (or the environment variable
+KNN_SURVIVAL_USE_NUMBA=0) to switch the compiled kernels off. Compiled
+kernels are cached on disk (next to this module) unless
+KNN_SURVIVAL_NUMBA_CACHE=0, so compile time is only paid once;
+warm_up() compiles them upfront (eg. before timing experiments or
+forking workers).
+"""
+
+import os
+import numpy as np
+
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    numba = None
+    HAVE_NUMBA = False
+
+#%%============================================================================
+# Backend switches
+#==============================================================================
+
+# use compiled kernels (only possible if numba is installed)
+USE_NUMBA = HAVE_NUMBA and \
+            (os.environ.get("KNN_SURVIVAL_USE_NUMBA", "1") != "0")
+
+# keep compiled kernels on disk (read when kernels are defined)
+CACHE = os.environ.get("KNN_SURVIVAL_NUMBA_CACHE", "1") != "0"
+
+#==============================================================================
+
+def _jit(func):
+
+    """Compile func with numba if available (else keep python version)"""
+
+    if HAVE_NUMBA:
+        return numba.njit(cache=CACHE)(func)
+    return func
+
+#%%============================================================================
+# Kernels
+#==============================================================================
+
+def _c_index_counts(risk, T, C):
+
+    """
+    No of concordant and orderable pairs, with the same rules as
+    sUtils.c_index.
+
+    Args:
+    -----
+    risk - predicted risk; (N,) float64
+    T - time to event or last follow-up; (N,) float64
+    C - censorship indicator (1 = censored); (N,) int64
+
+    Returns:
+    --------
+    score, n_orderable - floats
+    """
+
+    n_orderable = 0.0
+    score = 0.0
+
+    N = T.shape[0]
+    for i in range(N):
+        for j in range(i + 1, N):
+
+            # both cases are observed
+            if C[i] == 0 and C[j] == 0:
+                n_orderable += 1
+                if T[i] > T[j]:
+                    if risk[j] > risk[i]:
+                        score += 1
+                elif T[j] > T[i]:
+                    if risk[i] > risk[j]:
+                        score += 1
+                else:
+                    if risk[i] == risk[j]:
+                        score += 1
+
+            # i is censored while j is observed
+            elif C[i] == 1 and C[j] == 0:
+                if T[i] >= T[j]:
+                    n_orderable += 1
+                    if T[i] > T[j]:
+                        if risk[j] > risk[i]:
+                            score += 1
+
+            # i is observed while j is censored
+            elif C[j] == 1 and C[i] == 0:
+                if T[j] >= T[i]:
+                    n_orderable += 1
+                    if T[j] > T[i]:
+                        if risk[i] > risk[j]:
+                            score += 1
+
+    return score, n_orderable
+
+c_index_counts = _jit(_c_index_counts)
+
+#==============================================================================
+
+def _concordant_counts(T, C, risk_rank, n_ranks, query, insert):
+
+    """
+    For every observed case, no of cases with a strictly longer time 
+    and strictly lower risk, summed over observed cases (counting with 
+    a Fenwick tree over risk ranks). See sUtils.c_index.
+
+    Args:
+    -----
+    T - time to event or last follow-up, sorted descending; (N,) float64
+    C - censorship indicator (1 = censored); (N,) int64
+    risk_rank - dense rank of risk (0 = lowest); (N,) int64
+    n_ranks - no of distinct risks
+    query, insert - (N,) bool; only pairs of a case to query (observed)
+                    and a case to insert (i.e. to compare it with) are 
+                    counted, eg. to count pairs across two sets only
+
+    Returns:
+    --------
+    score - float
+    """
+
+    tree = np.zeros(n_ranks + 1, dtype=np.int64)
+    score = 0.0
+
+    N = T.shape[0]
+    start = 0
+    while start < N:
+
+        # group of tied times
+        end = start
+        while end < N and T[end] == T[start]:
+            end += 1
+
+        # count cases with longer times (already in tree) and lower risk
+        for k in range(start, end):
+            if C[k] == 0 and query[k]:
+                idx = risk_rank[k]
+                while idx > 0:
+                    score += tree[idx]
+                    idx -= idx & (-idx)
+
+        # add group to tree
+        for k in range(start, end):
+            if (C[k] == 0 or C[k] == 1) and insert[k]:
+                idx = risk_rank[k] + 1
+                while idx <= n_ranks:
+                    tree[idx] += 1
+                    idx += idx & (-idx)
+
+        start = end
+
+    return score
+
+concordant_counts = _jit(_concordant_counts)
+
+#==============================================================================
+
+def _alive_status(Survival, Censored, n_times):
+
+    """
+    Alive status matrix, same as sUtils.getAliveStatus.
+
+    Args:
+    -----
+    Survival - survival in needed (integer) time scale; (N,) int32
+    Censored - censorship indicator (1 = censored); (N,) int64
+    n_times - no of time points (columns)
+
+    Returns:
+    --------
+    aliveStatus - (N, n_times) int32 (1 = alive, 0 = dead, -1 = unknown)
+    """
+
+    N = Survival.shape[0]
+    aliveStatus = np.ones((N, n_times), dtype=np.int32)
+
+    for idx in range(N):
+
+        # first time point after survival (python slicing rules)
+        start = Survival[idx] + 1
+        if start < 0:
+            start = max(start + n_times, 0)
+
+        status = 0 if Censored[idx] == 0 else -1
+        for t in range(start, n_times):
+            aliveStatus[idx, t] = status
+
+    return aliveStatus
+
+alive_status = _jit(_alive_status)
+
+#%%============================================================================
+# Warm-up
+#==============================================================================
+
+def warm_up():
+
+    """
+    Compile all kernels for the input types used by callers. With the
+    on-disk cache this only compiles once; later processes load them.
+    """
+
+    if not USE_NUMBA:
+        return
+
+    T = np.arange(4, dtype=np.float64)
+    C = np.array([0, 1, 0, 1], dtype=np.int64)
+
+    c_index_counts(T[::-1].copy(), T, C)
+    concordant_counts(T[::-1].copy(), C, np.arange(4, dtype=np.int64), 4,
+                      C >= 0, C >= 0)
+    alive_status(np.int32(T), C, 5)
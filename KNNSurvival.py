@@ -21,6 +21,8 @@ cwd = os.getcwd()
 conditionalAppend(cwd)
 
 #import _pickle
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
 #from matplotlib import cm
 #import matplotlib.pylab as plt
@@ -31,6 +33,40 @@ import numpy as np
 import ProjectUtils as pUtils
 import SurvivalUtils as sUtils
 import DataManagement as dm
+import NeighborUtils as nUtils
+
+#%%============================================================================
+# Parallel prediction workers (module-level so they can be pickled)
+#==============================================================================
+
+# training data shared by all chunks handled by a worker process
+_predict_worker_data = {}
+
+def _get_mp_context():
+    
+    """Fork where available so workers inherit (not copy) training data"""
+    
+    if 'fork' in mp.get_all_start_methods():
+        return mp.get_context('fork')
+    return mp.get_context()
+
+def _init_predict_worker(model, Survival_train, Censored_train):
+    
+    """Keep training data of this worker process"""
+    
+    _predict_worker_data['model'] = model
+    _predict_worker_data['Survival_train'] = Survival_train
+    _predict_worker_data['Censored_train'] = Censored_train
+
+def _predict_worker(neighbor_idxs, Method, Ks=None):
+    
+    """Predict one chunk of testing patients"""
+    
+    return _predict_worker_data['model']._predict_times(\
+            neighbor_idxs, 
+            _predict_worker_data['Survival_train'],
+            _predict_worker_data['Censored_train'],
+            Method=Method, Ks=Ks)
 
 #%%============================================================================
 # KNN model class (trainable model)
@@ -50,9 +86,14 @@ class SurvivalKNN(object):
     ###########################################################################
     
     def __init__(self, 
-                 RESULTPATH, description=""):
+                 RESULTPATH, description="", n_jobs=1):
         
-        """Instantiate a survival KNN object"""
+        """
+        Instantiate a survival KNN object
+        
+        n_jobs - no of testing-patient chunks processed concurrently 
+                 (threads for neighbor search, processes for prediction)
+        """
         
         # Set instance attributes
         #==================================================================
@@ -63,6 +104,11 @@ class SurvivalKNN(object):
         # prefix to all saved results
         self.description = description
         
+        self.n_jobs = n_jobs
+        
+        # alive status of last training set (see _get_alive_status)
+        self._alive_status_cache = {}
+        
         
         # Create output dirs
         #==================================================================
@@ -81,6 +127,7 @@ class SurvivalKNN(object):
         attribs = {
             'RESULTPATH' : self.RESULTPATH,
             'description' : self.description,
+            'n_jobs' : self.n_jobs,
             }
         
         return attribs
@@ -100,7 +147,9 @@ class SurvivalKNN(object):
     # Supporting methods
     #==============================================================================
 
-    def _get_neighbor_idxs(self, X_test, X_train, norm = 2):
+    def _get_neighbor_idxs(self, X_test, X_train, norm = 2,
+                           K_max = None, return_distances = False,
+                           search = "exact", search_params = {}):
         
         """ 
         Get indices of nearest neighbors.
@@ -112,27 +161,86 @@ class SurvivalKNN(object):
          
         X_test      - testing sample features; (N, D) np array
         X_train     - training sample features; (N, D) np array
+        K_max       - if given, only the K_max nearest neighbors are 
+                      found (partial selection) -> (N_test, K_max)
+        return_distances - also return distances of the neighbors
+        search      - one of "exact", "streaming", "tree" or "approximate":
+                      "exact" - brute force
+                      "streaming" - brute force over tiles of testing 
+                          and training samples with a running top-K, so
+                          the full distance matrix is never held 
+                          (tile sizes from memory_budget_bytes in 
+                          search_params)
+                      "tree" - KD-tree (nUtils.TreeIndex), only worth it
+                          for low-dimensional features, eg. after NCA 
+                          with a small dim_output or PCA
+                      "approximate" - inverted-file index with exact 
+                          re-ranking (nUtils.IVFIndex), for raw 
+                          high-dimensional features. Use n_probe in 
+                          search_params to trade recall for speed.
+        search_params - dict; passed to the "streaming" search or to 
+                        the index of "tree" and "approximate" search
         
         """
         
-        # Expand dims of AX to [n_samples_test, n_samples_train, n_features], 
-        # where each "channel" in the third dimension is the difference between
-        # one testing sample and all training samples along one feature
-        dist = X_train[None, :, :] - X_test[:, None, :]
+        if K_max is None:
+            K_max = X_train.shape[0]
+        
+        if search == "exact":
+            
+            def _search(X_test):
+                
+                # Get the manhattan or euclidian distance between every
+                # testing and training patient -> [n_test, n_train]
+                # (no sqrt for the l2 norm since only ranking is needed)
+                dist = nUtils.get_distances(X_test, X_train, norm=norm, 
+                                            squared=True)
+                # Get indices of K nearest neighbors
+                return nUtils.select_neighbors(\
+                        dist, norm=norm, K_max=K_max,
+                        return_distances=return_distances)
+        
+        elif search == "streaming":
+            
+            def _search(X_test):
+                return nUtils.streaming_neighbor_idxs(\
+                        X_test, X_train, K_max, norm=norm,
+                        return_distances=return_distances, **search_params)
+        
+        elif search in ["tree", "approximate"]:
+            
+            # Build index over training set once
+            if search == "tree":
+                index = nUtils.TreeIndex(X_train, norm=norm, **search_params)
+            else:
+                index = nUtils.IVFIndex(X_train, norm=norm, **search_params)
+            
+            def _search(X_test):
+                return index.query(X_test, K_max, 
+                                   return_distances=return_distances)
         
-        # Now get the manhattan or euclidian distance between
-        # every patient and all others -> [n_samples, n_samples]
-        if norm == 1:
-            dist = np.sum(np.abs(dist), axis=2)
-        elif norm == 2:
-            dist = np.sqrt(np.sum(dist ** 2, axis=2))
         else:
-            raise ValueError("Only l1 and l2 norms implemented.")
+            raise ValueError("search is one of 'exact', 'streaming', "
+                             "'tree' or 'approximate'.")
+        
+        # Search for neighbors of chunks of testing patients concurrently
+        # (threads; the heavy lifting is BLAS/scipy, which release the GIL)
+        n_jobs = min(self.n_jobs, X_test.shape[0])
         
-        # Get indices of K nearest neighbors
-        neighbor_idxs = np.argsort(dist, axis=1)
+        if n_jobs < 2:
+            return _search(X_test)
         
-        return neighbor_idxs
+        chunks = np.array_split(np.arange(X_test.shape[0]), n_jobs)
+        
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(\
+                    lambda chunk: _search(X_test[chunk, :]), chunks))
+        
+        if return_distances:
+            return (np.concatenate([j[0] for j in results], axis=0),
+                    np.concatenate([j[1] for j in results], axis=0))
+        
+        return np.concatenate(results, axis=0)
              
     #==========================================================================    
 
@@ -143,30 +251,315 @@ class SurvivalKNN(object):
 
         Args:
         -----
-        T - time-to-event
-        C - Censorship indicator
+        T - time-to-event; (N,) or (N_test, K) np array
+        C - Censorship indicator; same shape as T
 
         Returns:
         --------
-        t - unique times
+        For 1-D inputs:
+        t - unique times (of observed events)
         n - no. at risk
         d - no of observed events
+        For 2-D inputs, (N_test, K) arrays aligned with the times sorted 
+        along axis 1, where d is only non-zero at the last position of 
+        each group of tied event times (see _sort_neighbor_events).
         """
 
-        # find unique times
-        t = np.unique(T[C == 0])
+        T = np.asarray(T)
+        C = np.asarray(C)
+
+        if T.ndim == 2:
+            return self._sort_neighbor_events(T, C)
+
+        # find unique times and no of events at each
+        t, d = np.unique(T[C == 0], return_counts=True)
         
-        # initialize count vectors
-        d = np.zeros(t.shape)
-        n = np.zeros(t.shape)
+        # no at risk -> all cases not before each time
+        n = len(T) - np.searchsorted(np.sort(T), t, side='left')
+
+        return t, np.float64(n), np.float64(d)
+
+    #==========================================================================    
+
+    def _get_alive_status(self, Survival, Censored, packed = True):
+
+        """
+        Alive status (see sUtils.getAliveStatus) of a set of patients, 
+        cached so that repeated calls with the same outcomes (eg. when 
+        tuning K) do not rebuild it. Predictions do not need it (see
+        _alive_mean_times); this is for when the dense form is needed.
+
+        Args:
+        -----
+        Survival, Censored - (N,) np arrays
+        packed - if True, return bit-packed status (sUtils.packAliveStatus)
+                 else the dense (N, n_times) int32 matrix
+
+        """
+
+        key = (Survival.tobytes(), np.asarray(Censored).tobytes())
+
+        # only keep the last set of outcomes
+        if key not in self._alive_status_cache:
+            self._alive_status_cache = \
+                {key: sUtils.packAliveStatus(Survival, Censored)}
+
+        status = self._alive_status_cache[key]
+
+        if not packed:
+            status = sUtils.unpackAliveStatus(status)
+
+        return status
+
+    #==========================================================================    
+
+    def _sort_neighbor_events(self, T, C, presorted = False):
+
+        """
+        Event counts of many neighbor sets at once (vectorized version of
+        _get_events).
+
+        Args:
+        -----
+        T - time-to-event of neighbors; (N_test, K) np array
+        C - censorship indicator of neighbors; (N_test, K) np array
+        presorted - whether T (and C) are already sorted along axis 1
+
+        Returns:
+        --------
+        T - times sorted along axis 1; (N_test, K)
+        n - no. at risk at each sorted time; (N_test, K)
+        d - no of observed events at each sorted time, counted at the 
+            last position of each group of tied times (0 elsewhere); 
+            (N_test, K)
+        """
+
+        # sort times (and censorship) along neighbors
+        if not presorted:
+            order = np.argsort(T, axis=-1, kind='mergesort')
+            T = np.take_along_axis(T, order, axis=-1)
+            C = np.take_along_axis(C, order, axis=-1)
+        T = np.float64(T)
+        E = np.int64(C == 0)
+
+        K = T.shape[-1]
+        pos = np.arange(K)
+
+        # first and last position of each group of tied times
+        is_start = np.ones(T.shape, dtype=np.bool_)
+        is_start[..., 1:] = T[..., 1:] != T[..., :-1]
+        is_end = np.ones(T.shape, dtype=np.bool_)
+        is_end[..., :-1] = is_start[..., 1:]
+        start = np.maximum.accumulate(np.where(is_start, pos, 0), axis=-1)
+
+        # no at risk -> all neighbors from the start of the tie group on
+        n = K - start
+
+        # no of events within each tie group
+        E_cum = np.cumsum(E, axis=-1)
+        d = E_cum - np.take_along_axis(E_cum - E, start, axis=-1)
+        d = np.where(is_end, d, 0)
+
+        return T, n, d
+
+    #==========================================================================    
+
+    def _km_mean_times(self, T, C, presorted = False):
+
+        """
+        Mean survival time (area under the kaplan-meier survivor 
+        function) for many neighbor sets at once. Same as integrating
+        _km_estimator of each row, including the all-censored case
+        (where the result is the max time).
+
+        Args:
+        -----
+        T - time-to-event of neighbors; (N_test, K) np array
+        C - censorship indicator of neighbors; (N_test, K) np array
+        presorted - whether T (and C) are already sorted along axis 1
+
+        Returns:
+        --------
+        T_pred - (N_test,) np array
+        """
+
+        T, n, d = self._sort_neighbor_events(T, C, presorted=presorted)
+
+        # survival probability after each sorted time
+        f = np.cumprod(np.where(d > 0, (n - d) / n, 1.), axis=-1)
+
+        # area under survivor function from 0 to the max time
+        return self._area_under_steps(T, f, d > 0, f_start=1.)
         
-        # generate counts
-        for i in range(len(t)):
-            n[i] = np.sum(T >= t[i]) # <- no at risk
-            d[i] = np.sum(T[C == 0] == t[i]) # <- no of events
+    #==========================================================================    
 
-        return t, n, d
+    def _na_integrated_hazard(self, T, C, time_grid = None, 
+                              presorted = False):
+
+        """
+        Integral under the Nelson-Aalen cumulative hazard for many 
+        neighbor sets at once. Same as integrating _na_estimator of each
+        row; rows where all neighbors are censored get 0.
 
+        Args:
+        -----
+        T - time-to-event of neighbors; (N_test, K) np array
+        C - censorship indicator of neighbors; (N_test, K) np array
+        time_grid - optional sorted (G,) array of times at which to also
+                    return the cumulative hazard curves
+        presorted - whether T (and C) are already sorted along axis 1
+
+        Returns:
+        --------
+        T_pred - (N_test,) np array
+        (H - (N_test, G) cumulative hazard on time_grid, if given)
+        """
+
+        T, n, d = self._sort_neighbor_events(T, C, presorted=presorted)
+
+        # cumulative hazard after each sorted time
+        H = np.cumsum(np.where(d > 0, d / n, 0.), axis=-1)
+
+        # area under cumulative hazard from 0 to the max time
+        T_pred = self._area_under_steps(T, H, d > 0, f_start=0.)
+
+        if time_grid is None:
+            return T_pred
+
+        return T_pred, self._eval_on_grid(T, H, time_grid, f_start=0.)
+
+    #==========================================================================
+
+    def _alive_mean_times(self, T, C, presorted = False):
+
+        """
+        Sum over days of the mean known alive status of many neighbor
+        sets at once. Same as the "non-cumulative" prediction using
+        sUtils.getAliveStatus, but from sorted event times only
+        (i.e. without the dense alive-status matrix).
+
+        Between two consecutive sorted times t_j < t_j+1 the neighbors
+        beyond j are alive and the status of neighbors censored at or
+        before j is unknown, so every day in (t_j, t_j+1] contributes
+        (K - j - 1) / (K - no. censored up to j).
+
+        Args:
+        -----
+        T - time-to-event of neighbors; (N_test, K) np array
+        C - censorship indicator of neighbors; (N_test, K) np array
+        presorted - whether T (and C) are already sorted along axis 1
+
+        Returns:
+        --------
+        T_pred - (N_test,) np array
+        """
+
+        # alive status is defined on whole days
+        T = np.floor(T)
+
+        # sort times (and censorship) along neighbors
+        if not presorted:
+            order = np.argsort(T, axis=-1, kind='mergesort')
+            T = np.take_along_axis(T, order, axis=-1)
+            C = np.take_along_axis(C, order, axis=-1)
+        T = np.float64(T)
+        cens = C != 0
+
+        K = T.shape[-1]
+
+        # alive / known neighbors on the days following each sorted time
+        alive = K - np.arange(1, K)
+        known = K - np.cumsum(cens, axis=-1)[..., :-1]
+
+        # all neighbors are alive and known up to (and incl.) the first time
+        T_pred = T[..., 0] + 1
+        T_pred += np.sum(np.diff(T, axis=-1) * alive / known, axis=-1)
+
+        return T_pred
+
+    #==========================================================================
+
+    def _area_under_steps(self, T, f, changes, f_start):
+
+        """
+        Area under step functions from 0 to the max time of each row,
+        where the functions only change at event times. Same terms as 
+        np.sum(np.diff(t) * f[0:-1]) over the output of _km_estimator 
+        or _na_estimator.
+
+        Args:
+        -----
+        T - sorted times; (N_test, K)
+        f - function values from each time on; (N_test, K)
+        changes - where the function changes (last position of each 
+                  group of tied event times); (N_test, K) bool
+        f_start - function value before the first change
+
+        Returns:
+        --------
+        area - (N_test,) np array
+        """
+
+        T_max = T[..., -1:]
+
+        # next change time after each position (or the max time)
+        t_change = np.where(changes, T, np.inf)
+        t_next = np.minimum.accumulate(t_change[..., ::-1], axis=-1)[..., ::-1]
+        t_next = np.concatenate((t_next[..., 1:], 
+                                 np.full(T_max.shape, np.inf)), axis=-1)
+        t_next = np.minimum(t_next, T_max)
+
+        # from 0 to first change (or max time if nothing changes)
+        t_first = np.minimum(np.min(t_change, axis=-1), T_max[..., 0])
+
+        areas = np.concatenate((t_first[..., None] * f_start, 
+                                np.where(changes, (t_next - T) * f, 0.)), 
+                               axis=-1)
+
+        return np.sum(areas, axis=-1)
+        
+    #==========================================================================    
+
+    def _eval_on_grid(self, T, f, time_grid, f_start, gpos = None):
+
+        """
+        Evaluate right-continuous step functions on a shared time grid.
+
+        Args:
+        -----
+        T - sorted times at which the functions change; (N_test, K)
+        f - function values from each time on; (N_test, K)
+        time_grid - sorted (G,) array of times
+        f_start - function value before the first time
+        gpos - optional no of grid points before each time, if already
+               known (see predict_curves); (N_test, K)
+
+        Returns:
+        --------
+        f_grid - (N_test, G) np array
+        """
+
+        time_grid = np.asarray(time_grid)
+        assert np.all(np.diff(time_grid) >= 0)
+
+        N_test, K = T.shape
+        G = len(time_grid)
+
+        # no of grid points before each time
+        if gpos is None:
+            gpos = np.searchsorted(time_grid, T, side='left')
+
+        # no of times <= each grid point (per row)
+        rows = np.arange(N_test)[:, None] * (G + 1)
+        counts = np.bincount((rows + gpos).ravel(), 
+                             minlength=N_test * (G + 1))
+        counts = np.cumsum(counts.reshape([N_test, G + 1]), axis=1)[:, 0:G]
+
+        # value at last time <= each grid point
+        f = np.concatenate((np.full([N_test, 1], f_start), f), axis=1)
+
+        return np.take_along_axis(f, counts, axis=1)
+        
     #==========================================================================    
 
     def _km_estimator(self, T, C):
@@ -257,80 +650,50 @@ class SurvivalKNN(object):
         Survival_train - training sample time-to-event; (N,) np array
         Censored_train - training sample censorship status; (N,) np array
         K           - number of nearest-neighbours to use, int
+        Method      - prediction method, or a list of methods. With a 
+                      list, outcomes of the neighbors are gathered and 
+                      sorted only once and predictions and c-indices 
+                      are returned as dicts indexed by method.
+        
+        If self.n_jobs > 1, testing patients are split into chunks that
+        are predicted by a pool of processes.
         """
         
         # Keep only desired K
         neighbor_idxs = neighbor_idxs[:, 0:K]
 
-        # Initialize        
-        N_test = neighbor_idxs.shape[0]
-        T_test = np.zeros([N_test])
-
-        if Method == 'non-cumulative':
+        T_test = self._run_prediction(neighbor_idxs, 
+                                      Survival_train, Censored_train, 
+                                      Method=Method)
+        
+        # Get c-index
+        Ci = self._get_ci(T_test, Survival_test, Censored_test, 
+                          Method=Method)
             
-            # Convert outcomes to "alive status" at each time point 
-            alive_train = sUtils.getAliveStatus(Survival_train, Censored_train)
-    
-            # Get survival prediction for each patient            
-            for idx in range(N_test):
-                
-                status = alive_train[neighbor_idxs[idx, :], :]
-                totalKnown = np.sum(status >= 0, axis = 0)
-                status[status < 0] = 0
-                
-                # remove timepoints where there are no known statuses
-                # (i.e. after last neighbor dies or gets censored)
-                status = status[:, totalKnown != 0]
-                totalKnown = totalKnown[totalKnown != 0]
-                
-                # get "average" predicted survival time
-                status = np.sum(status, axis = 0) / totalKnown
-                
-                # now get overall time prediction            
-                T_test[idx] = np.sum(status)
-                
-        elif Method in ['cumulative-time', 'cumulative-hazard']:
+        return T_test, Ci
 
-                # itirate through patients
+    #==========================================================================
 
-                for idx in range(N_test):
-                    
-                    # Get time and censorship
-                    T = Survival_train[neighbor_idxs[idx, :]]
-                    C = Censored_train[neighbor_idxs[idx, :]]
-    
-                    if C.min() == 1:
-                        # All cases are censored
-                        if Method == "cumulative-time":
-                            T_test[idx] = T.max()
-                        elif Method == "cumulative-hazard":
-                            T_test[idx] = 0
-                        continue
-                        
-                    if Method == "cumulative-time":
-                    
-                        # Get km estimator
-                        t, f = self._km_estimator(T, C)
-                    
-                        # Get mean survival time
-                        T_test[idx] = np.sum(np.diff(t) * f[0:-1])
-                    
-                    elif Method == 'cumulative-hazard':
-                    
-                        # Get NA estimator
-                        T = Survival_train[neighbor_idxs[idx, :]]
-                        C = Censored_train[neighbor_idxs[idx, :]]
-                        t, f = self._na_estimator(T, C)
-                    
-                        # Get integral under cum. hazard curve
-                        T_test[idx] = np.sum(np.diff(t) * f[0:-1])
+    def _get_ci(self, T_test, Survival_test = None, Censored_test = None, 
+                Method = "cumulative-time"):
         
-        else:
-            raise ValueError("Method not implemented.")
-                   
+        """
+        C-index of predictions of a method (0 if testing outcomes are 
+        not given). If Method is a list, T_test is a dict of predictions
+        and a dict of c-indices is returned. If predictions are 
+        (N_test, M), the c-index of each column is returned (M,), 
+        scored together by sUtils.c_index_many.
+        """
+        
+        if not isinstance(Method, str):
+            return {M: self._get_ci(T_test[M], Survival_test, 
+                                    Censored_test, Method=M) \
+                    for M in Method}
         
-        # Get c-index
         Ci = 0
+        if np.ndim(T_test) == 2:
+            Ci = np.zeros([T_test.shape[1]])
+        
         if Method == "cumulative-hazard":
             prediction_type = "risk"
         else:
@@ -338,10 +701,264 @@ class SurvivalKNN(object):
 
         if Survival_test is not None:
             assert (Censored_test is not None)
-            Ci = sUtils.c_index(T_test, Survival_test, Censored_test, 
-                                prediction_type= prediction_type)
+            if np.ndim(T_test) == 2:
+                Ci = sUtils.c_index_many(T_test, Survival_test, 
+                                         Censored_test, 
+                                         prediction_type= prediction_type)
+            else:
+                Ci = sUtils.c_index(T_test, Survival_test, Censored_test, 
+                                    prediction_type= prediction_type)
+        
+        return Ci
+
+    #==========================================================================
+
+    def predict_multi_k(self, neighbor_idxs,
+                        Survival_train, Censored_train, 
+                        Survival_test = None, Censored_test = None, 
+                        Ks = list(np.arange(10, 160, 10)), 
+                        Method = "cumulative-time"):
+        
+        """
+        Predict testing set for many values of K.
+        Same as calling predict() for each K in Ks, but the outcomes of 
+        the neighbors (as many as the largest K) are gathered and sorted 
+        only once. Since the neighbors of each K are a prefix of 
+        neighbor_idxs, the sorted outcomes of each K are just the sorted 
+        outcomes of its own neighbors (in the same order), and the 
+        estimators are run directly on those (still once per K).
+        As in predict(), a K larger than the no of available neighbors
+        uses all of them.
+        
+        neighbor_idxs - indices of nearest neighbors; (N_test, max(Ks))
+        Survival_train - training sample time-to-event; (N,) np array
+        Censored_train - training sample censorship status; (N,) np array
+        Ks          - list of K values
+        Method      - prediction method, or a list of methods (outputs
+                      are then dicts indexed by method; see predict())
+        
+        Returns:
+        --------
+        T_test - predictions; (N_test, len(Ks)) np array
+        CIs - c-index of each K; (len(Ks),) np array (zeros if no 
+              testing outcomes are given)
+        """
+        
+        # Keep only as many neighbors as needed
+        neighbor_idxs = neighbor_idxs[:, 0:np.max(Ks)]
+        
+        T_test = self._run_prediction(neighbor_idxs, 
+                                      Survival_train, Censored_train, 
+                                      Method=Method, Ks=Ks)
+        
+        # Get c-index of each K
+        CIs = self._get_ci(T_test, Survival_test, Censored_test, 
+                           Method=Method)
             
-        return T_test, Ci
+        return T_test, CIs
+
+    #==========================================================================
+
+    def predict_curves(self, neighbor_idxs,
+                       Survival_train, Censored_train, 
+                       time_grid = None, t_unit = 30,
+                       K = 30, Method = "cumulative-time"):
+        
+        """
+        Predict survival curves of testing set on a time grid.
+        
+        neighbor_idxs - indices of nearest neighbors; (N_test, >= K)
+        Survival_train - training sample time-to-event; (N,) np array
+        Censored_train - training sample censorship status; (N,) np array
+        time_grid   - sorted (G,) array of times. Defaults to every 
+                      t_unit (eg. 30, 180 or 365 days) from 0 to the 
+                      max training time.
+        K           - number of nearest-neighbours to use, int
+        Method      - "cumulative-time" -> kaplan-meier survivor function
+                      "cumulative-hazard" -> exp(-nelson-aalen cumulative
+                                             hazard)
+                      "non-cumulative" -> mean known alive status on 
+                                          each day (see _alive_mean_times)
+        
+        Returns:
+        --------
+        S - survival probability at each grid time; (N_test, G) float32
+        time_grid - (G,) np array
+        
+        Use sUtils.summarize_curves for scalar summaries (mean, median,
+        survival at horizons) of the curves.
+        """
+        
+        if time_grid is None:
+            time_grid = np.arange(0, np.max(Survival_train), t_unit)
+        time_grid = np.asarray(time_grid)
+        
+        neighbor_idxs = neighbor_idxs[:, 0:K]
+        K = neighbor_idxs.shape[1]
+        
+        if Method == 'non-cumulative':
+            # status changes the day after the (whole) survival day
+            Survival_train = np.floor(Survival_train) + 1
+        elif Method not in ['cumulative-time', 'cumulative-hazard']:
+            raise ValueError("Method not implemented.")
+        
+        # grid position of every training time (once for all patients)
+        gpos_train = np.searchsorted(time_grid, Survival_train, side='left')
+        
+        # sort outcomes of neighbors (with their grid positions)
+        T = Survival_train[neighbor_idxs]
+        order = np.argsort(T, axis=-1, kind='mergesort')
+        neighbor_idxs = np.take_along_axis(neighbor_idxs, order, axis=-1)
+        T = Survival_train[neighbor_idxs]
+        C = Censored_train[neighbor_idxs]
+        gpos = gpos_train[neighbor_idxs]
+        
+        if Method == 'non-cumulative':
+            
+            # alive / known neighbors from each (sorted) time on
+            alive = K - np.arange(1, K + 1)
+            known = K - np.cumsum(C != 0, axis=-1)
+            f = alive / np.maximum(known, 1)
+            
+        else:
+            T, n, d = self._sort_neighbor_events(T, C, presorted=True)
+            
+            if Method == 'cumulative-time':
+                f = np.cumprod(np.where(d > 0, (n - d) / n, 1.), axis=-1)
+            else:
+                f = np.exp(-np.cumsum(np.where(d > 0, d / n, 0.), axis=-1))
+        
+        S = self._eval_on_grid(T, f, time_grid, f_start=1., gpos=gpos)
+        
+        return np.float32(S), time_grid
+
+    #==========================================================================
+
+    def _run_prediction(self, neighbor_idxs,
+                        Survival_train, Censored_train,
+                        Method = "cumulative-time", Ks = None):
+        
+        """
+        Get predictions for testing patients given their nearest 
+        neighbors; split into chunks predicted by a pool of processes 
+        if self.n_jobs > 1. See _predict_times().
+        """
+        
+        Methods = [Method] if isinstance(Method, str) else Method
+        for M in Methods:
+            if M not in ['non-cumulative', 'cumulative-time', 
+                         'cumulative-hazard']:
+                raise ValueError("Method not implemented.")
+
+        N_test = neighbor_idxs.shape[0]
+        n_jobs = min(self.n_jobs, N_test)
+        
+        if n_jobs > 1:
+            
+            # training arrays are handed to every worker once (and not
+            # copied at all where processes are forked)
+            chunks = np.array_split(neighbor_idxs, n_jobs, axis=0)
+            
+            with ProcessPoolExecutor(\
+                    max_workers=n_jobs, 
+                    mp_context=_get_mp_context(),
+                    initializer=_init_predict_worker,
+                    initargs=(self, Survival_train, 
+                              Censored_train)) as executor:
+                T_test = list(executor.map(\
+                        _predict_worker, chunks, 
+                        [Method] * len(chunks),
+                        [Ks] * len(chunks)))
+            
+            if isinstance(Method, str):
+                T_test = np.concatenate(T_test)
+            else:
+                T_test = {M: np.concatenate([t[M] for t in T_test]) \
+                          for M in Method}
+        else:
+            T_test = self._predict_times(neighbor_idxs, 
+                                         Survival_train, Censored_train, 
+                                         Method=Method, Ks=Ks)
+        
+        return T_test
+
+    #==========================================================================
+
+    def _predict_times(self, neighbor_idxs,
+                       Survival_train, Censored_train,
+                       Method = "cumulative-time", Ks = None):
+        
+        """
+        Get predictions for testing patients given their K nearest 
+        neighbors; (N_test, K). See predict().
+        If Ks is given, predictions use the first K neighbors for each 
+        K in Ks -> (N_test, len(Ks)). See predict_multi_k().
+        If Method is a list, a dict of predictions of each method is
+        returned.
+        """
+        
+        Methods = [Method] if isinstance(Method, str) else Method
+        
+        estimators = {}
+        for M in Methods:
+            
+            if M == 'non-cumulative':
+                
+                # Get "average" known alive status, summed over time, of 
+                # the neighbors of all patients at once
+                estimators[M] = self._alive_mean_times
+                    
+            elif M == 'cumulative-time':
+                
+                # Get mean survival time of the K-M estimator of the
+                # neighbors of all patients at once
+                estimators[M] = self._km_mean_times
+                    
+            elif M == 'cumulative-hazard':
+                
+                # Get integral under the Nelson-Aalen cumulative hazard of 
+                # the neighbors of all patients at once
+                estimators[M] = self._na_integrated_hazard
+            
+            else:
+                raise ValueError("Method not implemented.")
+        
+        T = Survival_train[neighbor_idxs]
+        C = Censored_train[neighbor_idxs]
+        
+        if (Ks is None) and isinstance(Method, str):
+            return estimators[Method](T, C)
+        
+        # sort outcomes of all neighbors once (shared by all methods)
+        order = np.argsort(T, axis=-1, kind='mergesort')
+        T = np.take_along_axis(T, order, axis=-1)
+        C = np.take_along_axis(C, order, axis=-1)
+        
+        if Ks is None:
+            T_test = {M: estimators[M](T, C, presorted=True) \
+                      for M in Methods}
+        
+        else:
+            T_test = {M: np.zeros([neighbor_idxs.shape[0], len(Ks)]) \
+                      for M in Methods}
+            
+            for kidx, K in enumerate(Ks):
+                
+                # sorted outcomes of the K nearest neighbors 
+                # (exactly K per row, or all available neighbors)
+                K = min(K, neighbor_idxs.shape[1])
+                is_neighbor = order < K
+                T_K = T[is_neighbor].reshape([-1, K])
+                C_K = C[is_neighbor].reshape([-1, K])
+                
+                for M in Methods:
+                    T_test[M][:, kidx] = estimators[M](T_K, C_K, 
+                                                       presorted=True)
+        
+        if isinstance(Method, str):
+            return T_test[Method]
+        
+        return T_test
 
     #==========================================================================
     
@@ -354,17 +971,27 @@ class SurvivalKNN(object):
                              feats_per_bag=None,
                              K=30,
                              Method="cumulative-time",
-                             norm=2):
+                             norm=2,
+                             search="exact",
+                             search_params={},
+                             bags_per_chunk=None,
+                             n_jobs=1,
+                             seed=None):
         
         """
         Predict survival with random subspace bagging.
+        search, search_params - neighbor search (see _get_neighbor_idxs)
+        bags_per_chunk, n_jobs - with exact search, the neighbors of all 
+            bags are found with stacked masked matmuls, bags_per_chunk 
+            at a time and spread over n_jobs threads 
+            (see nUtils.bagged_neighbor_idxs)
+        Method - prediction method, or a list of methods sharing the 
+                 same bags (outputs are then dicts; see predict())
+        seed - if given, features of each bag are drawn from 
+               np.random.default_rng([seed, bag]) (reproducible, and 
+               independent of the global np.random state)
         """
         
-        if Method == "cumulative-hazard":
-            prediction_type = "risk"
-        else:
-            prediction_type = "survival_time"
-        
         #
         # sanity checks and defaults
         #
@@ -385,44 +1012,67 @@ class SurvivalKNN(object):
         # initialize
         #
         
-        preds = np.zeros([X_test.shape[0], n_bags])
+        N_test = X_test.shape[0]
         
-        # Doing all the shufling first since for some reason
-        # np shuffle does not work insider the next loop!
-        idxs = np.arange(X_train.shape[1])
-        idx_shuffles = []
-        for shuff in range(n_bags):
-            np.random.shuffle(idxs)
-            idx_shuffles.append(idxs.copy()[0:feats_per_bag])
+        if seed is not None:
+            idx_shuffles = [np.random.default_rng([seed, bag]).permutation(\
+                                X_train.shape[1])[0:feats_per_bag] \
+                            for bag in range(n_bags)]
+        else:
+            # Doing all the shufling first since for some reason
+            # np shuffle does not work insider the next loop!
+            idxs = np.arange(X_train.shape[1])
+            idx_shuffles = []
+            for shuff in range(n_bags):
+                np.random.shuffle(idxs)
+                idx_shuffles.append(idxs.copy()[0:feats_per_bag])
         
         #
-        # predict using random subspaces
+        # get neighbors in random subspaces
         #
         
-        for bag, idxs in enumerate(idx_shuffles):
+        if search == "exact":
+            
+            # all bags at once -> (n_bags, N_test, K)
+            masks = np.zeros([n_bags, X_train.shape[1]], dtype=np.bool_)
+            for bag, idxs in enumerate(idx_shuffles):
+                masks[bag, idxs] = True
             
-            # Get neighbor indices    
-            neighbor_idxs = self._get_neighbor_idxs(\
+            neighbor_idxs = nUtils.bagged_neighbor_idxs(\
+                    X_test, X_train, masks, K, norm=norm,
+                    bags_per_chunk=bags_per_chunk, n_jobs=n_jobs)
+        
+        else:
+            neighbor_idxs = np.array([self._get_neighbor_idxs(\
                     X_test[:, idxs], 
                     X_train[:, idxs], 
-                    norm = norm)
+                    norm = norm, K_max = K,
+                    search = search, search_params = search_params) \
+                    for idxs in idx_shuffles])
         
-            # Predict testing set
-            t_test, _ = self.predict(neighbor_idxs,
-                                     Survival_train, Censored_train, 
-                                     K=K, Method=Method)
-           
-            preds[:, bag] = t_test
+        #
+        # predict every (bag, patient) pair in one pass
+        #
+        
+        t_test, _ = self.predict(\
+                neighbor_idxs.reshape([n_bags * N_test, -1]),
+                Survival_train, Censored_train, 
+                K=K, Method=Method)
         
         # Aggregate prediction
-        t_test = np.median(preds, axis=1)
+        def _aggregate(t_test):
+            preds = t_test.reshape([n_bags, N_test]).T
+            return np.median(preds, axis=1)
+        
+        if isinstance(Method, str):
+            t_test = _aggregate(t_test)
+        else:
+            t_test = {M: _aggregate(t_test[M]) for M in Method}
 
         # Get Ci if survival data available
-        Ci = 0
-        if Survival_test is not None:
-            assert (Censored_test is not None)
-            Ci = sUtils.c_index(t_test, Survival_test, Censored_test, 
-                                prediction_type= prediction_type)
+        Ci = self._get_ci(t_test, Survival_test, Censored_test, 
+                          Method=Method)
+        
         return t_test, Ci
         
     
@@ -452,12 +1102,11 @@ class SurvivalKNN(object):
 
         n_subspaces - no of subspaces to use.
         min_n_feats - minimum no of features to use
+        Method - prediction method, or a list of methods sharing the 
+                 same subspaces (outputs are then dicts; see predict())
         """
 
-        if Method == "cumulative-hazard":
-            prediction_type = "risk"
-        else:
-            prediction_type = "survival_time"
+        Methods = [Method] if isinstance(Method, str) else Method
         
         # sanity checks
         if n_subspaces > X_test.shape[1]:
@@ -466,38 +1115,40 @@ class SurvivalKNN(object):
             min_n_feats = X_test.shape[1]-1
             
         # initialize
-        preds = np.zeros([X_test.shape[0], n_subspaces-min_n_feats])
+        preds = {M: np.zeros([X_test.shape[0], n_subspaces-min_n_feats]) \
+                 for M in Methods}
 
         maxidxs = np.arange(min_n_feats, X_test.shape[1])
         np.random.shuffle(maxidxs)
         maxidxs = maxidxs[0: n_subspaces-min_n_feats]
 
-        for subspace, fidx_max in enumerate(maxidxs):
+        # Get neighbor indices for all subspaces in one sweep over columns
+        # (yielded in ascending order of fidx_max)
+        prefix_neighbors = nUtils.prefix_neighbor_idxs(\
+                X_test, X_train, maxidxs, norm = norm, K_max = K)
 
+        for fidx_max, neighbor_idxs in prefix_neighbors:
+
+            subspace = list(maxidxs).index(fidx_max)
             #print('\t\tSubspace {} of {}'.format(subspace, n_subspaces-1))
-            
-            # Get neighbor indices    
-            neighbor_idxs = self._get_neighbor_idxs(\
-                    X_test[:, 0:fidx_max], 
-                    X_train[:, 0:fidx_max], 
-                    norm = norm)
         
             # Predict testing set
             t_test, _ = self.predict(neighbor_idxs,
                                      Survival_train, Censored_train, 
-                                     K=K, Method=Method)
+                                     K=K, Method=Methods)
            
-            preds[:, subspace] = t_test
+            for M in Methods:
+                preds[M][:, subspace] = t_test[M]
 
         # Aggregate prediction
-        t_test = np.median(preds, axis=1)
+        t_test = {M: np.median(preds[M], axis=1) for M in Methods}
+        if isinstance(Method, str):
+            t_test = t_test[Method]
 
         # Get Ci if survival data available
-        Ci = 0
-        if Survival_test is not None:
-            assert (Censored_test is not None)
-            Ci = sUtils.c_index(t_test, Survival_test, Censored_test, 
-                                prediction_type= prediction_type)
+        Ci = self._get_ci(t_test, Survival_test, Censored_test, 
+                          Method=Method)
+        
         return t_test, Ci
 
 
@@ -508,7 +1159,8 @@ class SurvivalKNN(object):
     def tune_k(self, X, Survival, Censored,
                kcv=4, shuffles=5, \
                Ks=list(np.arange(10, 160, 10)),\
-               norm=2, Method = "cumulative-time"):
+               norm=2, Method = "cumulative-time",
+               dist_store=None, search="exact", search_params={}):
 
         """
         Given an **optimization set**, get optimal K using
@@ -519,8 +1171,14 @@ class SurvivalKNN(object):
         kcv - no of folds for cross validation
         shuffles - no of shuffles for cross validation
         Ks - list of K values to try out
+        dist_store - optional nUtils.DistanceStore over the same patients
+                     as X (distances are then sliced, not recomputed)
+        search, search_params - neighbor search (see _get_neighbor_idxs)
         """
 
+        if dist_store is not None:
+            assert dist_store.norm == norm
+
         # Get split indices over optimization set
         splitIdxs = dm.get_balanced_SplitIdxs(Censored, \
                                               K=kcv, SHUFFLES=shuffles,\
@@ -539,31 +1197,33 @@ class SurvivalKNN(object):
             idxs_train = splitIdxs['fold_cv_train'][0][fold]
             idxs_test = splitIdxs['fold_cv_test'][0][fold]
             
-            X_test = X[idxs_test, :]
-            X_train = X[idxs_train, :]
             Survival_train = Survival[idxs_train]
             Censored_train = Censored[idxs_train]
             Survival_test = Survival[idxs_test]
             Censored_test = Censored[idxs_test]
         
-            # Get neighbor indices    
-            neighbor_idxs = self._get_neighbor_idxs(X_test, X_train, norm = norm)
+            # Get neighbor indices (only as many as the largest K)
+            if dist_store is not None:
+                neighbor_idxs = dist_store.get_neighbor_idxs(\
+                        idxs_test, idxs_train, K_max = np.max(Ks))
+            else:
+                neighbor_idxs = self._get_neighbor_idxs(\
+                        X[idxs_test, :], X[idxs_train, :], norm = norm,
+                        K_max = np.max(Ks), search = search,
+                        search_params = search_params)
         
             
+            # Predict testing set (all Ks at once)
+            _, CIs[fold, :] = self.predict_multi_k(\
+                    neighbor_idxs, Survival_train, Censored_train, 
+                    Survival_test = Survival_test, 
+                    Censored_test = Censored_test, 
+                    Ks = Ks, Method = Method)
+            
             print("\tK \t Ci")
         
             for kidx, K in enumerate(Ks):
-            
-                # Predict testing set
-                _, Ci = self.predict(neighbor_idxs,
-                                     Survival_train, Censored_train, 
-                                     Survival_test = Survival_test, 
-                                     Censored_test = Censored_test, 
-                                     K = K, Method = Method)
-            
-                CIs[fold, kidx] = Ci
-            
-                print("\t{} \t {}".format(K, round(Ci, 3)))
+                print("\t{} \t {}".format(K, round(CIs[fold, kidx], 3)))
                              
         
         # Get optimal K
@@ -622,7 +1282,7 @@ class SurvivalKNN(object):
             # Generate random ensembles
             ensembles = np.random.randint(0, X.shape[1], [n_ensembles, subset_size])
             
-            print("\n\tfold\tensemble\tCi")
+            preds = np.zeros([len(test_idxs), n_ensembles])
 
             for eidx in range(n_ensembles):
             
@@ -631,21 +1291,28 @@ class SurvivalKNN(object):
                 neighborIdxs = self._get_neighbor_idxs(\
                                 X[test_idxs, :][:, fidx], 
                                 X[train_idxs, :][:, fidx], 
-                                norm=norm)
+                                norm=norm, K_max=K)
         
-                # get accuracy
-                _, ci = self.predict(\
+                # predict
+                preds[:, eidx], _ = self.predict(\
                          neighborIdxs, 
                          T[train_idxs], 
                          C[train_idxs],
-                         Survival_test=T[test_idxs], 
-                         Censored_test=C[test_idxs],
                          K=K,
                          Method=Method)
+            
+            # get accuracy of all ensembles at once
+            cis = self._get_ci(preds, T[test_idxs], C[test_idxs], 
+                               Method=Method)
+            
+            print("\n\tfold\tensemble\tCi")
+            
+            for eidx in range(n_ensembles):
+                
+                fidx = ensembles[eidx, :]
+                feat_ci[eidx, fidx, fold] = cis[eidx]
         
-                feat_ci[eidx, fidx, fold] = ci
-        
-                print("\t{}\t{}\t{}".format(fold, eidx, round(ci, 3)))
+                print("\t{}\t{}\t{}".format(fold, eidx, round(cis[eidx], 3)))
         
         # Get feature ranks
         
@@ -722,13 +1389,11 @@ class SurvivalKNN(object):
         
             print("\tn_feats \t Ci")
         
-            for fidx, n_feats in enumerate(n_feats_all):
+            # Get neighbor indices for all n_feats in one sweep over columns
+            prefix_neighbors = nUtils.prefix_neighbor_idxs(\
+                    X_test, X_train, n_feats_all, norm=norm, K_max=K)
         
-                # Get neighbor indices
-                neighbor_idxs = self._get_neighbor_idxs(\
-                        X_test[:, 0:n_feats], 
-                        X_train[:, 0:n_feats], 
-                        norm=norm)
+            for fidx, (n_feats, neighbor_idxs) in enumerate(prefix_neighbors):
             
                 # Predict testing set
                 _, Ci = self.predict(neighbor_idxs,
@@ -762,7 +1427,10 @@ class SurvivalKNN(object):
                     splitIdxs, outer_fold, 
                     k_tune_params,
                     USE_BAGGING=False,
-                    bagging_params={}):
+                    bagging_params={},
+                    dist_store=None,
+                    search="exact",
+                    search_params={}):
 
         """
         Find model accuracy using KCV (after ptimizing K)
@@ -773,6 +1441,11 @@ class SurvivalKNN(object):
         splitIdxs - dict; indices of patients belonging to each fold
         outer_fold - fold index for optimization and non-optim. sets
         k_tune_params - dict; parameters to pass to tune_k method
+        dist_store - optional nUtils.DistanceStore built on X (only used 
+                     without bagging, since bags use feature subspaces)
+        search, search_params - neighbor search (see _get_neighbor_idxs);
+                                also used for tuning K unless 
+                                k_tune_params says otherwise
         """
 
         # Initialize
@@ -781,11 +1454,20 @@ class SurvivalKNN(object):
         n_folds = len(splitIdxs['fold_cv_train'][0])
         CIs = np.zeros([n_folds])
 
+        if dist_store is not None:
+            assert dist_store.norm == norm
+
         print("\nOptimizing K for this outer fold.")
 
         # find optimal K on validation set
         optimIdxs = splitIdxs['idx_optim'][outer_fold]
 
+        k_tune_params = dict(k_tune_params)
+        k_tune_params.setdefault('search', search)
+        k_tune_params.setdefault('search_params', search_params)
+        if dist_store is not None:
+            k_tune_params['dist_store'] = dist_store.subset(optimIdxs)
+
         _, K_optim = self.tune_k(X[optimIdxs, :], \
                                   Survival[optimIdxs], \
                                   Censored[optimIdxs], \
@@ -800,8 +1482,6 @@ class SurvivalKNN(object):
             idxs_train = splitIdxs['fold_cv_train'][outer_fold][fold]
             idxs_test = splitIdxs['fold_cv_test'][outer_fold][fold]
             
-            X_test = X[idxs_test, :]
-            X_train = X[idxs_train, :]
             Survival_train = Survival[idxs_train]
             Censored_train = Censored[idxs_train]
             Survival_test = Survival[idxs_test]
@@ -810,7 +1490,7 @@ class SurvivalKNN(object):
             if USE_BAGGING:
                 # predict with bagging
                 _, Ci = self.predict_with_bagging(\
-                                     X_test, X_train,
+                                     X[idxs_test, :], X[idxs_train, :],
                                      Survival_train,
                                      Censored_train,
                                      Survival_test=Survival_test,
@@ -818,10 +1498,19 @@ class SurvivalKNN(object):
                                      K=K_optim,
                                      Method=Method,
                                      norm=norm,
+                                     search=search,
+                                     search_params=search_params,
                                      **bagging_params)
             else:
                 # Get neighbor indices    
-                neighbor_idxs = self._get_neighbor_idxs(X_test, X_train, norm = norm)
+                if dist_store is not None:
+                    neighbor_idxs = dist_store.get_neighbor_idxs(\
+                            idxs_test, idxs_train, K_max = K_optim)
+                else:
+                    neighbor_idxs = self._get_neighbor_idxs(\
+                            X[idxs_test, :], X[idxs_train, :], norm = norm,
+                            K_max = K_optim, search = search,
+                            search_params = search_params)
             
                 # Predict testing set
                 _, Ci = self.predict(neighbor_idxs,
@@ -334,12 +334,12 @@ class SurvivalNCA(object):
             neighbor_idxs_train = \
                 knnmodel._get_neighbor_idxs(x_train, 
                                             x_train, 
-                                            norm=norm)
+                                            norm=norm, K_max=K)
             if USE_VALID:
                 neighbor_idxs_valid = \
                     knnmodel._get_neighbor_idxs(x_valid, 
                                                 x_train, 
-                                                norm=norm)
+                                                norm=norm, K_max=K)
             
             # Predict training/validation set
             _, Ci_train = knnmodel.predict(neighbor_idxs_train,
@@ -500,6 +500,12 @@ class SurvivalNCA(object):
                     Ws = np.zeros((D, self.graph.dim_output, MODEL_BUFFER))
                     Cis = []
                 
+                # Balanced batches (if relevant) differ every epoch
+                n = censored.shape[0]
+                if BATCH_SIZE < n:
+                    batch_sampler = dm.StratifiedBatchSampler(\
+                                        censored, BATCH_SIZE=BATCH_SIZE)
+                
                 while itir < MAX_ITIR:
                     
                     #pUtils.Log_and_print("\n\tTraining epoch {}\n".format(self.EPOCHS_RUN))
@@ -532,19 +538,9 @@ class SurvivalNCA(object):
                     # Divide into balanced batches
                     #==========================================================
                     
-                    n = censored.shape[0]
-                    
-                    # Get balanced batches (if relevant)
                     if BATCH_SIZE < n:
-                        # Shuffle so that training batches differ every epoch
-                        idxs = np.arange(features.shape[0]);
-                        np.random.shuffle(idxs)
-                        features = features[idxs, :]
-                        survival = survival[idxs]
-                        censored  = censored[idxs]
                         # stochastic mini-batch GD
-                        batchIdxs = dm.get_balanced_batches(censored, 
-                                                            BATCH_SIZE=BATCH_SIZE)
+                        batchIdxs = batch_sampler.sample()
                     else:
                         # Global GD
                         batchIdxs = [np.arange(n)]
@@ -561,21 +557,14 @@ class SurvivalNCA(object):
                             
                     for batchidx, batch in enumerate(batchIdxs):
                         
-                        # Getting at-risk groups
-                        t_batch, o_batch, at_risk_batch, x_batch = \
-                            sUtils.calc_at_risk(survival[batch], 
+                        # Get at-risk mask (to be multiplied by Pij),
+                        # with cases sorted w.r.t. time of death
+                        order, at_risk_batch, Pij_mask = \
+                            sUtils.get_pij_mask(survival[batch], 
                                                 1-censored[batch],
-                                                features[batch, :])
-                                                
-                        # Get at-risk mask (to be multiplied by Pij)
-                        n_batch = t_batch.shape[0]
-
-                        Pij_mask = np.zeros((n_batch, n_batch))
-                        for idx in range(n_batch):
-                            # only observed cases
-                            if o_batch[idx] == 1:
-                                # only at-risk cases
-                                Pij_mask[idx, at_risk_batch[idx]:] = 1
+                                                mask_type='at-risk',
+                                                dtype=np.float32)
+                        x_batch = features[batch[order], :]
                         
                         # run optimizer and fetch cost
                         feed_dict[self.graph.X_input] = x_batch
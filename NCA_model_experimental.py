@@ -346,12 +346,12 @@ class SurvivalNCA(object):
             neighbor_idxs_train = \
                 knnmodel._get_neighbor_idxs(x_train, 
                                             x_train, 
-                                            norm=norm)
+                                            norm=norm, K_max=K)
             if USE_VALID:
                 neighbor_idxs_valid = \
                     knnmodel._get_neighbor_idxs(x_valid, 
                                                 x_train, 
-                                                norm=norm)
+                                                norm=norm, K_max=K)
             
             # Predict training/validation set
             _, Ci_train = knnmodel.predict(neighbor_idxs_train,
@@ -513,6 +513,12 @@ class SurvivalNCA(object):
                         Ws = np.zeros((D, self.graph.dim_output, MODEL_BUFFER))
                         Cis = []
                 
+                # Balanced batches (if relevant) differ every epoch
+                n = censored.shape[0]
+                if BATCH_SIZE < n:
+                    batch_sampler = dm.StratifiedBatchSampler(\
+                                        censored, BATCH_SIZE=BATCH_SIZE)
+                
                 while itir < MAX_ITIR:
                     
                     #pUtils.Log_and_print("\n\tTraining epoch {}\n".format(self.EPOCHS_RUN))
@@ -545,19 +551,9 @@ class SurvivalNCA(object):
                     # Divide into balanced batches
                     #==========================================================
                     
-                    n = censored.shape[0]
-                    
-                    # Get balanced batches (if relevant)
                     if BATCH_SIZE < n:
-                        # Shuffle so that training batches differ every epoch
-                        idxs = np.arange(features.shape[0]);
-                        np.random.shuffle(idxs)
-                        features = features[idxs, :]
-                        survival = survival[idxs]
-                        censored  = censored[idxs]
                         # stochastic mini-batch GD
-                        batchIdxs = dm.get_balanced_batches(censored, 
-                                                            BATCH_SIZE=BATCH_SIZE)
+                        batchIdxs = batch_sampler.sample()
                     else:
                         # Global GD
                         batchIdxs = [np.arange(n)]
@@ -574,37 +570,14 @@ class SurvivalNCA(object):
                             
                     for batchidx, batch in enumerate(batchIdxs):
                         
-                        # Getting at-risk groups
-                        t_batch, o_batch, at_risk_batch, x_batch = \
-                            sUtils.calc_at_risk(survival[batch], 
+                        # Get mask (to be multiplied by Pij),
+                        # with cases sorted w.r.t. time of death
+                        order, at_risk_batch, Pij_mask = \
+                            sUtils.get_pij_mask(survival[batch], 
                                                 1-censored[batch],
-                                                features[batch, :])
-                                                
-                        # Get mask (to be multiplied by Pij)
-                        # -----------------------------------------------------
-                        n_batch = t_batch.shape[0]
-                        Pij_mask = np.zeros((n_batch, n_batch))
-                        
-                        # Get difference in outcomes between all cases
-                        if mask_type == 'observed':
-                            outcome_diff = np.abs(t_batch[None, :] - t_batch[:, None])
-                            
-                        for idx in range(n_batch):
-                            
-                            # only observed cases
-                            if o_batch[idx] == 1:
-                                
-                                if mask_type == 'at-risk':
-                                    # only at-risk cases (unweighted)
-                                    Pij_mask[idx, at_risk_batch[idx]:] = 1
-                                    
-                                elif mask_type == 'observed':
-                                    # only observed cases (weighted)
-                                    Pij_mask[idx, o_batch==1] = 1
-                                    
-                        if mask_type == 'observed':
-                            Pij_mask = Pij_mask * outcome_diff
-                        # -----------------------------------------------------
+                                                mask_type=mask_type,
+                                                dtype=np.float32)
+                        x_batch = features[batch[order], :]
                         
                         # run optimizer and fetch cost
                         feed_dict[self.graph.X_input] = x_batch
@@ -0,0 +1,847 @@
+# -*- coding: utf-8 -*-
+"""
+Tools for nearest-neighbor search (distance kernels).
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.spatial import cKDTree
+
+#%%============================================================================
+# Distance kernels
+#==============================================================================
+
+# max no of elements in the intermediate |a - b| L1 tensor
+L1_TILE_ELEMENTS = 2 ** 24
+
+# max no of elements in the intermediate tensors of a chunk of bags
+BAG_CHUNK_ELEMENTS = 2 ** 26
+
+# default memory budget of streaming neighbor search
+STREAMING_BUDGET_BYTES = 2 ** 28
+
+#==============================================================================
+
+def _as_float(X):
+
+    """Make sure features are floating point (keeps float32 as is)"""
+
+    X = np.asarray(X)
+    if not np.issubdtype(X.dtype, np.floating):
+        X = X.astype(np.float64)
+    return X
+
+#==============================================================================
+
+def l2_distances(X_test, X_train, squared=False):
+
+    """
+    Euclidian distance between every testing and training sample using
+    ||a||^2 + ||b||^2 - 2 a.b, i.e. a single matrix multiplication
+    (no (N_test, N_train, D) tensor is ever allocated).
+
+    Args:
+    -----
+    X_test  - testing sample features; (N_test, D) np array
+    X_train - training sample features; (N_train, D) np array
+    squared - if True, skip the sqrt (enough when only ranking is needed)
+
+    Returns:
+    --------
+    dist - (N_test, N_train) np array
+    """
+
+    X_test = _as_float(X_test)
+    X_train = _as_float(X_train)
+
+    sq_test = np.einsum('ij,ij->i', X_test, X_test)
+    sq_train = np.einsum('ij,ij->i', X_train, X_train)
+
+    dist = np.dot(X_test, X_train.T)
+    dist *= -2
+    dist += sq_test[:, None]
+    dist += sq_train[None, :]
+
+    # round-off may produce tiny negative values
+    np.maximum(dist, 0, out=dist)
+
+    if not squared:
+        np.sqrt(dist, out=dist)
+
+    return dist
+
+#==============================================================================
+
+def _l1_tiles(N_test, N_train, D, tile_elements):
+
+    """
+    Slices of testing samples, training samples and features, such that
+    each (test tile, train tile, feature tile) block of the L1 
+    intermediate tensor has at most tile_elements elements. Training 
+    samples (then features) are only tiled when a single testing 
+    sample would exceed tile_elements.
+    """
+
+    feat_tile = int(max(1, min(D, tile_elements)))
+    train_tile = int(max(1, min(N_train, tile_elements // feat_tile)))
+    test_tile = int(max(1, tile_elements // (train_tile * feat_tile)))
+
+    for test_start in range(0, N_test, test_tile):
+        for train_start in range(0, N_train, train_tile):
+            for feat_start in range(0, D, feat_tile):
+                yield (slice(test_start, test_start + test_tile),
+                       slice(train_start, train_start + train_tile),
+                       slice(feat_start, feat_start + feat_tile))
+
+#==============================================================================
+
+def l1_distances(X_test, X_train, tile_elements=None):
+
+    """
+    Manhattan distance between every testing and training sample.
+    Samples (and, if needed, features) are processed in tiles so that 
+    the intermediate |a - b| tensor never exceeds tile_elements.
+
+    Args:
+    -----
+    X_test  - testing sample features; (N_test, D) np array
+    X_train - training sample features; (N_train, D) np array
+    tile_elements - max no of elements in the intermediate tensor
+
+    Returns:
+    --------
+    dist - (N_test, N_train) np array
+    """
+
+    X_test = _as_float(X_test)
+    X_train = _as_float(X_train)
+
+    if tile_elements is None:
+        tile_elements = L1_TILE_ELEMENTS
+
+    N_test = X_test.shape[0]
+    N_train, D = X_train.shape
+
+    dist = np.zeros([N_test, N_train],
+                    dtype=np.result_type(X_test, X_train))
+
+    for test, train, feats in _l1_tiles(N_test, N_train, D, tile_elements):
+        diff = X_train[None, train, feats] - X_test[test, None, feats]
+        dist[test, train] += np.sum(np.abs(diff), axis=2)
+
+    return dist
+
+#==============================================================================
+
+def get_distances(X_test, X_train, norm=2, squared=False):
+
+    """
+    Get (N_test, N_train) distance matrix using the l1 or l2 norm.
+    squared only applies to the l2 norm (skips the sqrt).
+    """
+
+    if norm == 1:
+        return l1_distances(X_test, X_train)
+    elif norm == 2:
+        return l2_distances(X_test, X_train, squared=squared)
+    else:
+        raise ValueError("Only l1 and l2 norms implemented.")
+
+#%%============================================================================
+# Neighbor selection
+#==============================================================================
+
+def get_topk(dist, K, return_distances=False):
+
+    """
+    Get indices of the K smallest distances in each row, sorted by 
+    distance. Uses partitioned selection so that only the selected 
+    (N_test, K) block is sorted.
+
+    Args:
+    -----
+    dist - (N_test, N_train) distance matrix
+    K - no of neighbors to keep
+    return_distances - also return the (N_test, K) distances
+
+    Returns:
+    --------
+    neighbor_idxs - (N_test, K) np array
+    (dist_K - (N_test, K) np array, if return_distances)
+    """
+
+    K = int(min(K, dist.shape[1]))
+
+    if K < dist.shape[1]:
+        neighbor_idxs = np.argpartition(dist, K - 1, axis=1)[:, 0:K]
+    else:
+        neighbor_idxs = np.tile(np.arange(K), (dist.shape[0], 1))
+
+    # sort only the selected block
+    dist_K = np.take_along_axis(dist, neighbor_idxs, axis=1)
+    order = np.argsort(dist_K, axis=1)
+    neighbor_idxs = np.take_along_axis(neighbor_idxs, order, axis=1)
+
+    if return_distances:
+        dist_K = np.take_along_axis(dist_K, order, axis=1)
+        return neighbor_idxs, dist_K
+
+    return neighbor_idxs
+
+#==============================================================================
+
+def select_neighbors(dist, norm=2, K_max=None, return_distances=False):
+
+    """
+    Get indices of nearest neighbors from a distance matrix 
+    (squared distances for the l2 norm).
+
+    Args:
+    -----
+    dist - (N_test, N_train) distance matrix
+    norm - norm used to get dist (needed to un-square l2 distances)
+    K_max - if given, only the K_max nearest neighbors are found
+            (partial selection) -> (N_test, K_max)
+    return_distances - also return distances of the neighbors
+    """
+
+    if K_max is None:
+        neighbor_idxs = np.argsort(dist, axis=1)
+        if return_distances:
+            dist = np.take_along_axis(dist, neighbor_idxs, axis=1)
+    else:
+        neighbor_idxs, dist = get_topk(dist, K_max, return_distances=True)
+
+    if return_distances:
+        if norm == 2:
+            dist = np.sqrt(dist)
+        return neighbor_idxs, dist
+
+    return neighbor_idxs
+
+#==============================================================================
+
+def prefix_neighbor_idxs(X_test, X_train, n_feats, norm=2, K_max=None,
+                         return_distances=False):
+
+    """
+    Get nearest neighbors using only the first n columns of the features,
+    for several cutoffs n (eg. when sweeping the no of NCA features or 
+    principal components). Squared l2 (and l1) distances are additive 
+    over columns, so the distance of each prefix is that of the previous
+    prefix plus the contribution of the new columns only, and the whole
+    sweep costs about one full distance computation.
+
+    Args:
+    -----
+    X_test  - testing sample features; (N_test, D) np array
+    X_train - training sample features; (N_train, D) np array
+    n_feats - list of cutoffs (no of leading columns to use)
+    norm, K_max, return_distances - see select_neighbors
+
+    Yields:
+    -------
+    (n, neighbor_idxs) for each cutoff, in ascending order of n 
+    (or (n, neighbor_idxs, dist) if return_distances)
+    """
+
+    D = X_test.shape[1]
+    dist = np.zeros([X_test.shape[0], X_train.shape[0]],
+                    dtype=np.result_type(_as_float(X_test[:0]), 
+                                         _as_float(X_train[:0])))
+    n_prev = 0
+
+    for n in sorted(set(int(j) for j in n_feats)):
+
+        # add contribution of new columns
+        n_clipped = min(n, D)
+        if n_clipped > n_prev:
+            dist += get_distances(X_test[:, n_prev:n_clipped], 
+                                  X_train[:, n_prev:n_clipped], 
+                                  norm=norm, squared=True)
+            n_prev = n_clipped
+
+        neighbors = select_neighbors(dist, norm=norm, K_max=K_max,
+                                     return_distances=return_distances)
+
+        if return_distances:
+            yield (n,) + neighbors
+        else:
+            yield n, neighbors
+
+#==============================================================================
+
+def _get_streaming_tiles(N_test, N_train, D, K, itemsize, norm,
+                         memory_budget_bytes):
+
+    """
+    Pick (test_tile, train_tile) so that the memory used by one tile
+    of streaming neighbor search stays within memory_budget_bytes.
+    """
+
+    # bytes per (testing, training) pair in a tile: the distance (plus
+    # the l1 difference tensor) and the merge buffers (distance + index)
+    if norm == 1:
+        pair_bytes = itemsize * (D + 2) + 8
+    else:
+        pair_bytes = itemsize * 2 + 8
+
+    n_pairs = max(1, memory_budget_bytes // pair_bytes)
+
+    train_tile = int(min(N_train, max(K, np.sqrt(n_pairs))))
+    test_tile = int(max(1, min(N_test, n_pairs // train_tile)))
+    train_tile = int(min(N_train, max(train_tile, n_pairs // test_tile)))
+
+    return test_tile, train_tile
+
+#==============================================================================
+
+def streaming_neighbor_idxs(X_test, X_train, K, norm=2, 
+                            memory_budget_bytes=None,
+                            return_distances=False):
+
+    """
+    Get the K nearest neighbors without ever holding the full
+    (N_test, N_train) distance matrix. Both testing and training samples
+    are tiled and a running top-K is merged for every testing sample.
+
+    Args:
+    -----
+    X_test  - testing sample features; (N_test, D) np array
+    X_train - training sample features; (N_train, D) np array
+    K - no of neighbors
+    norm - 1 or 2 (manhattan or euclidian)
+    memory_budget_bytes - approximate memory allowed for one tile
+                          (default: STREAMING_BUDGET_BYTES); 
+                          tile sizes are picked from it
+    return_distances - also return distances of the neighbors
+
+    Returns:
+    --------
+    neighbor_idxs - (N_test, K) np array
+    (dist - (N_test, K) np array, if return_distances)
+    """
+
+    X_test = _as_float(X_test)
+    X_train = _as_float(X_train)
+
+    if memory_budget_bytes is None:
+        memory_budget_bytes = STREAMING_BUDGET_BYTES
+
+    N_test = X_test.shape[0]
+    N_train, D = X_train.shape
+    K = int(min(K, N_train))
+    dtype = np.result_type(X_test, X_train)
+
+    test_tile, train_tile = _get_streaming_tiles(\
+            N_test, N_train, D, K, dtype.itemsize, norm, memory_budget_bytes)
+
+    neighbor_idxs = np.zeros([N_test, K], dtype=np.int64)
+    dist_K = np.zeros([N_test, K], dtype=dtype)
+
+    for test_start in range(0, N_test, test_tile):
+
+        test_stop = min(test_start + test_tile, N_test)
+        n_rows = test_stop - test_start
+
+        # running top-K of this tile of testing samples
+        best_dist = np.full([n_rows, K], np.inf, dtype=dtype)
+        best_idxs = np.full([n_rows, K], -1, dtype=np.int64)
+
+        for train_start in range(0, N_train, train_tile):
+
+            train_stop = min(train_start + train_tile, N_train)
+
+            if norm == 1:
+                dist = l1_distances(\
+                        X_test[test_start:test_stop, :], 
+                        X_train[train_start:train_stop, :],
+                        tile_elements=n_rows * (train_stop - train_start) * D)
+            else:
+                dist = get_distances(X_test[test_start:test_stop, :], 
+                                     X_train[train_start:train_stop, :], 
+                                     norm=norm, squared=True)
+
+            # merge with running top-K
+            cand_dist = np.concatenate((best_dist, dist), axis=1)
+            cand_idxs = np.concatenate(\
+                    (best_idxs, 
+                     np.tile(np.arange(train_start, train_stop), 
+                             (n_rows, 1))), axis=1)
+
+            keep = np.argpartition(cand_dist, K - 1, axis=1)[:, 0:K]
+            best_dist = np.take_along_axis(cand_dist, keep, axis=1)
+            best_idxs = np.take_along_axis(cand_idxs, keep, axis=1)
+
+        # sort selected neighbors
+        order = np.argsort(best_dist, axis=1)
+        neighbor_idxs[test_start:test_stop, :] = \
+            np.take_along_axis(best_idxs, order, axis=1)
+        dist_K[test_start:test_stop, :] = \
+            np.take_along_axis(best_dist, order, axis=1)
+
+    if return_distances:
+        if norm == 2:
+            dist_K = np.sqrt(dist_K)
+        return neighbor_idxs, dist_K
+
+    return neighbor_idxs
+
+#%%============================================================================
+# Random subspace bagging
+#==============================================================================
+
+def masked_distances(X_test, X_train, masks, norm=2):
+
+    """
+    Get distances within several feature subspaces at once.
+
+    Args:
+    -----
+    X_test  - testing sample features; (N_test, D) np array
+    X_train - training sample features; (N_train, D) np array
+    masks - (n_bags, D) np array, 1 for features in each subspace
+
+    Returns:
+    --------
+    dist - (n_bags, N_test, N_train) np array 
+           (squared distances for the l2 norm)
+    """
+
+    X_test = _as_float(X_test)
+    X_train = _as_float(X_train)
+    masks = np.asarray(masks, dtype=np.result_type(X_test, X_train))
+
+    if norm == 2:
+
+        # ||a||^2 and ||b||^2 within each subspace
+        sq_test = np.dot(X_test ** 2, masks.T)
+        sq_train = np.dot(X_train ** 2, masks.T)
+
+        # -2 a.b within each subspace (stacked masked matmul)
+        dist = np.matmul(X_test[None, :, :] * masks[:, None, :], X_train.T)
+        dist *= -2
+        dist += sq_test.T[:, :, None]
+        dist += sq_train.T[:, None, :]
+
+        np.maximum(dist, 0, out=dist)
+
+    elif norm == 1:
+
+        # |a - b| is computed once per tile and shared by all subspaces
+        N_test = X_test.shape[0]
+        N_train, D = X_train.shape
+
+        dist = np.zeros([masks.shape[0], N_test, N_train], dtype=masks.dtype)
+
+        for test, train, feats in _l1_tiles(N_test, N_train, D, 
+                                            L1_TILE_ELEMENTS):
+            diff = np.abs(X_train[None, train, feats] - \
+                          X_test[test, None, feats])
+            dist[:, test, train] += \
+                np.moveaxis(np.dot(diff, masks[:, feats].T), 2, 0)
+
+    else:
+        raise ValueError("Only l1 and l2 norms implemented.")
+
+    return dist
+
+#==============================================================================
+
+def bagged_neighbor_idxs(X_test, X_train, masks, K, norm=2,
+                         bags_per_chunk=None, n_jobs=1):
+
+    """
+    Get the K nearest neighbors within each of several random feature
+    subspaces (bags). Bags are processed in chunks so that the 
+    intermediate tensors stay bounded, and chunks may be spread across
+    threads (the heavy lifting is done by BLAS, which releases the GIL).
+
+    Args:
+    -----
+    X_test  - testing sample features; (N_test, D) np array
+    X_train - training sample features; (N_train, D) np array
+    masks - (n_bags, D) np array, 1 for features in each subspace
+    K - no of neighbors
+    norm - 1 or 2 (manhattan or euclidian)
+    bags_per_chunk - no of bags per chunk (default: from BAG_CHUNK_ELEMENTS)
+    n_jobs - no of threads
+
+    Returns:
+    --------
+    neighbor_idxs - (n_bags, N_test, K) np array
+    """
+
+    n_bags = masks.shape[0]
+    N_test = X_test.shape[0]
+    N_train, D = X_train.shape
+    K = int(min(K, N_train))
+
+    if bags_per_chunk is None:
+        bags_per_chunk = BAG_CHUNK_ELEMENTS // max(1, N_test * (N_train + D))
+    bags_per_chunk = int(max(1, bags_per_chunk))
+
+    def _get_chunk(start):
+
+        """Neighbors of one chunk of bags"""
+
+        dist = masked_distances(X_test, X_train, 
+                                masks[start:start + bags_per_chunk, :], 
+                                norm=norm)
+        n_chunk = dist.shape[0]
+        neighbor_idxs = get_topk(dist.reshape([n_chunk * N_test, N_train]), K)
+
+        return neighbor_idxs.reshape([n_chunk, N_test, K])
+
+    starts = range(0, n_bags, bags_per_chunk)
+
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            chunks = list(executor.map(_get_chunk, starts))
+    else:
+        chunks = [_get_chunk(start) for start in starts]
+
+    return np.concatenate(chunks, axis=0)
+
+#%%============================================================================
+# Precomputed distances (untransformed features)
+#==============================================================================
+
+class DistanceStore(object):
+
+    """
+    Pairwise distances between all patients of a cohort.
+
+    When features are not transformed (no NCA/PCA), the distance between
+    two patients is the same in every fold, so it is computed once here
+    and sliced as (test_idxs, train_idxs) blocks for each fold, K and 
+    method. For the l2 norm squared distances are kept (ranking only).
+    """
+
+    # Init
+    ###########################################################################
+
+    def __init__(self, X=None, norm=2, SAVEPATH=None):
+
+        """
+        Instantiate a distance store.
+
+        X - features of the whole cohort; (N, D) np array
+        norm - 1 or 2 (manhattan or euclidian)
+        SAVEPATH - optional path to a .npy file. If the file exists the 
+                   distances are loaded from it (memory-mapped), 
+                   otherwise they are computed, saved to it and then 
+                   memory-mapped. The norm and no of patients are saved
+                   next to it (<SAVEPATH without extension>_meta.npz) 
+                   and checked against norm (and X) when loading.
+        """
+
+        self.norm = norm
+        self.SAVEPATH = SAVEPATH
+
+        # indices of patients in the full distance matrix
+        # (None means all patients, see subset())
+        self.idxs = None
+
+        if (SAVEPATH is not None) and os.path.exists(SAVEPATH):
+            self.dist = np.load(SAVEPATH, mmap_mode='r')
+            self._check_saved(X)
+
+        else:
+            assert X is not None
+            self.dist = get_distances(X, X, norm=norm, squared=True)
+
+            if SAVEPATH is not None:
+                np.save(SAVEPATH, self.dist)
+                np.savez(self._meta_path(), norm=norm, N=X.shape[0])
+                self.dist = np.load(SAVEPATH, mmap_mode='r')
+
+    #==========================================================================
+
+    def _meta_path(self):
+
+        """Path of the file keeping the norm and N of saved distances"""
+
+        return os.path.splitext(self.SAVEPATH)[0] + '_meta.npz'
+
+    #==========================================================================
+
+    def _check_saved(self, X=None):
+
+        """
+        Make sure saved distances were computed with the same norm 
+        (and for as many patients as X, if given).
+        """
+
+        if not os.path.exists(self._meta_path()):
+            raise ValueError("No norm saved with distances in " + \
+                             self.SAVEPATH + ", delete it to recompute.")
+
+        with np.load(self._meta_path()) as meta:
+            norm, N = meta['norm'], meta['N']
+
+        if norm != self.norm:
+            raise ValueError("Distances in {} were computed with norm={}, "
+                             "not norm={}.".format(self.SAVEPATH, norm, 
+                                                    self.norm))
+
+        if (N != self.dist.shape[0]) or \
+           ((X is not None) and (N != X.shape[0])):
+            raise ValueError("Distances in {} are of {} patients, not {}."\
+                             .format(self.SAVEPATH, N, 
+                                     self.dist.shape[0] if X is None \
+                                     else X.shape[0]))
+
+    #==========================================================================
+
+    def subset(self, idxs):
+
+        """
+        Get a store restricted to a subset of patients (eg. the 
+        optimization set), sharing the same distance matrix.
+        Indices passed to the new store are relative to idxs.
+        """
+
+        new = DistanceStore.__new__(DistanceStore)
+        new.norm = self.norm
+        new.SAVEPATH = self.SAVEPATH
+        new.dist = self.dist
+        new.idxs = self._map(idxs)
+
+        return new
+
+    #==========================================================================
+
+    def _map(self, idxs):
+
+        """Map indices to rows/columns of the full distance matrix"""
+
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if self.idxs is not None:
+            idxs = self.idxs[idxs]
+        return idxs
+
+    #==========================================================================
+
+    def get_distances(self, test_idxs, train_idxs):
+
+        """
+        Get (N_test, N_train) block of distances
+        (squared distances for the l2 norm).
+        """
+
+        return self.dist[np.ix_(self._map(test_idxs), self._map(train_idxs))]
+
+    #==========================================================================
+
+    def get_neighbor_idxs(self, test_idxs, train_idxs, 
+                          K_max=None, return_distances=False):
+
+        """
+        Get indices of nearest neighbors of testing patients among 
+        training patients. Indices are positions in train_idxs 
+        (same convention as SurvivalKNN._get_neighbor_idxs).
+        """
+
+        dist = self.get_distances(test_idxs, train_idxs)
+
+        return select_neighbors(dist, norm=self.norm, K_max=K_max,
+                                return_distances=return_distances)
+
+#%%============================================================================
+# Tree-based neighbor index (low-dimensional features)
+#==============================================================================
+
+class TreeIndex(object):
+
+    """
+    KD-tree index over training samples.
+
+    Meant for low-dimensional features (eg. NCA-transformed with a small
+    dim_output, or the first few principal components), where querying
+    the K nearest neighbors is roughly O(log N) per testing sample 
+    instead of a brute-force pass over all training samples. Built once
+    per training set and queried as often as needed.
+    """
+
+    def __init__(self, X_train, norm=2, leafsize=16):
+
+        """
+        X_train - training sample features; (N_train, D) np array
+        norm - 1 or 2 (manhattan or euclidian)
+        leafsize - no of points at which the tree switches to brute force
+        """
+
+        if norm not in [1, 2]:
+            raise ValueError("Only l1 and l2 norms implemented.")
+
+        self.norm = norm
+        self.N_train = X_train.shape[0]
+        self.tree = cKDTree(_as_float(X_train), leafsize=leafsize)
+
+    #==========================================================================
+
+    def query(self, X_test, K, return_distances=False):
+
+        """
+        Get indices of the K nearest training samples of every testing 
+        sample, sorted by distance -> (N_test, K) np array (same 
+        convention as SurvivalKNN._get_neighbor_idxs).
+        """
+
+        K = int(min(K, self.N_train))
+
+        dist, neighbor_idxs = self.tree.query(_as_float(X_test), 
+                                              k=K, p=self.norm)
+
+        # scipy drops the last axis when K is 1
+        dist = dist.reshape([-1, K])
+        neighbor_idxs = np.int64(neighbor_idxs).reshape([-1, K])
+
+        if return_distances:
+            return neighbor_idxs, dist
+
+        return neighbor_idxs
+
+#%%============================================================================
+# Approximate neighbor index (high-dimensional features)
+#==============================================================================
+
+class IVFIndex(object):
+
+    """
+    Approximate neighbor index (inverted file with exact re-ranking).
+
+    Training samples are clustered with k-means into n_lists coarse cells.
+    Every testing sample is only compared (exactly) to the training 
+    samples in its n_probe closest cells, so for raw high-dimensional 
+    features (eg. 30000 genes) the cost of a query is roughly 
+    n_probe / n_lists of brute-force search. n_probe is the recall/speed 
+    knob; n_probe = n_lists gives exact search.
+    """
+
+    def __init__(self, X_train, norm=2, n_lists=None, n_probe=None,
+                 n_itir=10, seed=0):
+
+        """
+        X_train - training sample features; (N_train, D) np array
+        norm - 1 or 2 (manhattan or euclidian), used for re-ranking
+        n_lists - no of coarse cells (default: sqrt(N_train))
+        n_probe - no of cells searched per testing sample 
+                  (default: a quarter of the cells)
+        n_itir - no of k-means iterations
+        seed - seed of the k-means initialization
+        """
+
+        if norm not in [1, 2]:
+            raise ValueError("Only l1 and l2 norms implemented.")
+
+        X_train = _as_float(X_train)
+        N_train = X_train.shape[0]
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(N_train))
+        n_lists = int(max(1, min(n_lists, N_train)))
+        if n_probe is None:
+            n_probe = max(1, n_lists // 4)
+
+        self.norm = norm
+        self.X_train = X_train
+        self.n_lists = n_lists
+        self.n_probe = int(min(n_probe, n_lists))
+
+        # coarse quantizer
+        self.centroids, assign = self._kmeans(X_train, n_lists, n_itir, seed)
+
+        # members of each cell (inverted lists)
+        self.order = np.argsort(assign, kind='mergesort')
+        self.bounds = np.searchsorted(assign[self.order], 
+                                      np.arange(n_lists + 1))
+        self.sizes = np.diff(self.bounds)
+
+    #==========================================================================
+
+    def _kmeans(self, X, n_lists, n_itir, seed):
+
+        """Lloyd's k-means; returns centroids and cell assignments"""
+
+        rng = np.random.RandomState(seed)
+        centroids = X[rng.choice(X.shape[0], n_lists, replace=False), :]
+
+        for itir in range(n_itir):
+
+            assign = np.argmin(l2_distances(X, centroids, squared=True), 
+                               axis=1)
+
+            # update centroids (empty cells keep their old centroid)
+            for l in range(n_lists):
+                members = assign == l
+                if np.any(members):
+                    centroids[l, :] = np.mean(X[members, :], axis=0)
+
+        assign = np.argmin(l2_distances(X, centroids, squared=True), axis=1)
+
+        return centroids, assign
+
+    #==========================================================================
+
+    def query(self, X_test, K, return_distances=False):
+
+        """
+        Get (approximate) indices of the K nearest training samples of 
+        every testing sample, sorted by distance -> (N_test, K) np array
+        (same convention as SurvivalKNN._get_neighbor_idxs).
+        """
+
+        X_test = _as_float(X_test)
+        N_test = X_test.shape[0]
+        K = int(min(K, self.X_train.shape[0]))
+
+        # rank cells by distance to each testing sample
+        probe = np.argsort(l2_distances(X_test, self.centroids, 
+                                        squared=True), axis=1)
+
+        # probe n_probe cells, or more if needed to get K candidates
+        n_needed = np.sum(np.cumsum(self.sizes[probe], axis=1) < K, axis=1) + 1
+        n_probed = np.maximum(self.n_probe, n_needed)
+        # rank of each cell for each testing sample -> cells to search
+        probed = np.argsort(probe, axis=1) < n_probed[:, None]
+
+        # exact distances to candidates only (others stay at inf)
+        dist = np.full([N_test, self.X_train.shape[0]], np.inf)
+
+        for l in range(self.n_lists):
+
+            test_idxs = np.nonzero(probed[:, l])[0]
+            members = self.order[self.bounds[l]:self.bounds[l+1]]
+
+            if (len(test_idxs) == 0) or (len(members) == 0):
+                continue
+
+            dist[np.ix_(test_idxs, members)] = \
+                get_distances(X_test[test_idxs, :], self.X_train[members, :],
+                              norm=self.norm, squared=True)
+
+        return select_neighbors(dist, norm=self.norm, K_max=K,
+                                return_distances=return_distances)
+
+    #==========================================================================
+
+    def recall(self, X_test, K):
+
+        """
+        Recall of the approximate search against exact search, i.e. the
+        mean fraction of the true K nearest neighbors that are found.
+        """
+
+        approx_idxs = self.query(X_test, K)
+
+        dist = get_distances(X_test, self.X_train, norm=self.norm, 
+                             squared=True)
+        exact_idxs = select_neighbors(dist, norm=self.norm, K_max=K)
+
+        found = [len(np.intersect1d(approx_idxs[i, :], exact_idxs[i, :]))
+                 for i in range(exact_idxs.shape[0])]
+
+        return np.mean(found) / exact_idxs.shape[1]
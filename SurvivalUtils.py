@@ -10,6 +10,8 @@ A group of supporting utilities.
 
 import numpy as np
 from scipy.io import loadmat
+
+import JITUtils as jUtils
 #import matplotlib.pylab as plt
 
 #%%============================================================================
@@ -32,6 +34,11 @@ def getAliveStatus(Survival, Censored, t_min = 0, t_max = 0, scale = 1):
     if t_max == 0:
         t_max = np.max(Survival)
     
+    if jUtils.USE_NUMBA:
+        return jUtils.alive_status(np.ravel(Survival), 
+                                   np.int64(np.ravel(Censored)), 
+                                   t_max - t_min + 1)
+    
     # Initialize output matrix - rows are patients, cols are time points
     aliveStatus = np.ones([len(Survival), t_max - t_min +1])
     
@@ -47,6 +54,121 @@ def getAliveStatus(Survival, Censored, t_min = 0, t_max = 0, scale = 1):
             
     return np.int32(aliveStatus)
 
+#==============================================================================
+
+def packAliveStatus(Survival, Censored, t_min = 0, t_max = 0, scale = 1):
+
+    """
+    Bit-packed version of getAliveStatus (same arguments and same 
+    status, which changes at column Survival + 1 whatever t_min is). 
+    Instead of an int32 per patient per time point, this keeps two 
+    bits - alive and known status - so the output is ~64 times smaller.
+    Use unpackAliveStatus to get the dense matrix back.
+
+    Returns:
+    --------
+    packed - dict with:
+             'alive' - packed (status == 1); (N, ceil(n_times / 8)) uint8
+             'known' - packed (status >= 0); (N, ceil(n_times / 8)) uint8
+             'n_times' - no of time points (columns of dense matrix)
+    """
+
+    # Get data in needed scale
+    Survival = np.int32(np.floor(Survival / scale))
+
+    if t_max == 0:
+        t_max = np.max(Survival)
+
+    n_times = t_max - t_min + 1
+
+    # status changes at column Survival + 1, as in getAliveStatus
+    # (incl. python slicing rules for negative columns)
+    start = np.ravel(Survival) + 1
+    start = np.where(start < 0, np.maximum(start + n_times, 0), start)
+
+    # alive before that column, known unless censored
+    alive = np.arange(n_times)[None, :] < start[:, None]
+    known = alive | (np.ravel(Censored) == 0)[:, None]
+
+    packed = {'alive': np.packbits(alive, axis=1),
+              'known': np.packbits(known, axis=1),
+              'n_times': n_times,
+              }
+
+    return packed
+
+#==============================================================================
+
+def unpackAliveStatus(packed, idxs = None):
+
+    """
+    Dense alive status (1 = alive, 0 = dead, -1 = unknown) from the
+    output of packAliveStatus, optionally for a subset of patients (idxs).
+    """
+
+    alive = packed['alive']
+    known = packed['known']
+    if idxs is not None:
+        alive = alive[idxs]
+        known = known[idxs]
+
+    n_times = packed['n_times']
+    alive = np.unpackbits(alive, axis=-1)[..., 0:n_times]
+    known = np.unpackbits(known, axis=-1)[..., 0:n_times]
+
+    return np.int32(alive) + np.int32(known) - 1
+
+#==============================================================================
+
+def summarize_curves(S, time_grid, horizons = []):
+
+    """
+    Scalar summaries of survival curves evaluated on a time grid
+    (eg. output of SurvivalKNN.predict_curves), without going back to 
+    the neighbors.
+
+    Args:
+    -----
+    S - survival probabilities; (N, G) np array
+    time_grid - sorted (G,) array of times
+    horizons - list of times at which to get survival probability
+
+    Returns:
+    --------
+    summaries - dict with:
+                'mean' - area under curves from 0 to the last grid time
+                         (step functions, i.e. exact for curves that 
+                         only change at grid times); (N,)
+                'median' - first grid time where S <= 0.5 (np.inf if
+                           never reached); (N,)
+                'S_at' - survival at each horizon (value at the last grid
+                         time <= horizon); (N, len(horizons))
+    """
+
+    S = np.float64(S)
+    time_grid = np.asarray(time_grid, dtype=np.float64)
+
+    # 1 before the first grid time, then S at each grid time onwards
+    widths = np.diff(np.concatenate(([0], time_grid)))
+    S_left = np.concatenate((np.ones([S.shape[0], 1]), S[:, 0:-1]), axis=1)
+    mean = np.dot(S_left, widths)
+
+    # median
+    below = S <= 0.5
+    median = np.where(np.any(below, axis=1), 
+                      time_grid[np.argmax(below, axis=1)], np.inf)
+
+    # survival at horizons
+    hidxs = np.searchsorted(time_grid, horizons, side='right') - 1
+    S_at = np.where(hidxs >= 0, S[:, np.maximum(hidxs, 0)], 1.)
+
+    summaries = {'mean': mean,
+                 'median': median,
+                 'S_at': S_at,
+                 }
+
+    return summaries
+
 #%%============================================================================
 # Tools from SurvivalNet:
 #  https://github.com/CancerDataScience/SurvivalNet/blob/master/survivalnet/ ...
@@ -54,6 +176,411 @@ def getAliveStatus(Survival, Censored, t_min = 0, t_max = 0, scale = 1):
 #==============================================================================
 
 def c_index(prediction, T, C, prediction_type = 'risk'):
+
+    """
+    Calculate concordance index to evaluate model prediction, in 
+    O(n log n) by sorting and counting with a Fenwick tree. Same 
+    arguments, output, and tie / censoring rules as c_index_reference.
+
+    Concordant pairs are counted as, for every observed case, the no of
+    cases (observed or censored) with longer time and lower risk, plus 
+    pairs of observed cases with equal times and equal risks. Orderable
+    pairs are all pairs of observed cases plus pairs of a censored case 
+    and an observed case with a time that is not longer.
+    """
+
+    risk = _get_risk(prediction, prediction_type)
+    n_concordant, n_orderable, _ = _concordance_counts(risk, T, C)
+
+    if n_orderable == 0:
+        return 0
+
+    return n_concordant / n_orderable
+
+#==============================================================================
+
+def _concordance_counts(risk, T, C):
+
+    """
+    No of concordant pairs (incl. tied pairs), orderable pairs and 
+    tied pairs (observed, equal times and equal risks) of c_index.
+    """
+
+    risk = np.float64(np.ravel(risk))
+    T = np.float64(np.ravel(T))
+    C = np.int64(np.ravel(C))
+
+    observed = C == 0
+    censored = C == 1
+
+    # orderable pairs
+    n_observed = np.sum(observed)
+    T_observed = np.sort(T[observed])
+    n_orderable = n_observed * (n_observed - 1) / 2 + \
+        np.sum(np.searchsorted(T_observed, T[censored], side='right'))
+
+    if n_orderable == 0:
+        return 0., 0., 0.
+
+    # observed cases with longer time and lower risk
+    everyone = np.ones(len(T), dtype=np.bool_)
+    n_concordant = _count_concordant(T, C, risk, everyone, everyone)
+
+    # observed pairs with equal times and equal risks
+    _, n_tied = np.unique(np.stack((T[observed], risk[observed])), 
+                          axis=1, return_counts=True)
+    n_tied = np.sum(n_tied * (n_tied - 1) / 2)
+
+    return n_concordant + n_tied, n_orderable, n_tied
+
+#==============================================================================
+
+def _count_concordant(T, C, risk, query, insert):
+
+    """
+    No of pairs of an observed case to query and a case to insert with
+    longer time and lower risk (see jUtils.concordant_counts).
+    """
+
+    risk_ranks, risk_rank = np.unique(risk, return_inverse=True)
+    order = np.argsort(-T, kind='mergesort')
+    counts = jUtils.concordant_counts if jUtils.USE_NUMBA \
+        else jUtils._concordant_counts
+
+    return counts(T[order], C[order], np.int64(np.ravel(risk_rank)[order]), 
+                  len(risk_ranks), query[order], insert[order])
+
+#==============================================================================
+
+class CIndexAccumulator(object):
+
+    """
+    Concordance index accumulated over chunks of cases (eg. testing 
+    patients predicted in chunks, folds, or worker processes). 
+    Concordant, orderable and tied pair counts of each chunk are added 
+    with those of pairs across chunks, which are counted against the 
+    (sorted) outcomes and risks seen so far, so no O(n^2) pass is needed. 
+    Gives the same c-index as c_index over all cases.
+
+    Use update() for a chunk of predictions and merge() to combine 
+    accumulators (eg. from workers).
+
+    NOTE: For prediction_type = 'survival_time', risk is taken as 
+    -prediction (the normalization of c_index needs the max over all 
+    cases, and does not change order).
+    """
+
+    def __init__(self, prediction_type = 'risk'):
+
+        if prediction_type not in ['risk', 'survival_time']:
+            raise ValueError("prediction_type is either 'risk' or 'survival_time'.")
+
+        self.prediction_type = prediction_type
+
+        # pair counts
+        self.n_concordant = 0.
+        self.n_orderable = 0.
+        self.n_tied = 0.
+
+        # cases seen so far (sorted by descending time)
+        self.T = np.zeros([0])
+        self.C = np.zeros([0], dtype=np.int64)
+        self.risk = np.zeros([0])
+
+    #==========================================================================
+
+    def update(self, prediction, T, C):
+
+        """ Add a chunk of predictions and their outcomes"""
+
+        risk = np.float64(np.ravel(prediction))
+        if self.prediction_type == 'survival_time':
+            risk = -risk
+
+        chunk = CIndexAccumulator(self.prediction_type)
+        chunk.n_concordant, chunk.n_orderable, chunk.n_tied = \
+            _concordance_counts(risk, T, C)
+
+        order = np.argsort(-np.float64(np.ravel(T)), kind='mergesort')
+        chunk.T = np.float64(np.ravel(T))[order]
+        chunk.C = np.int64(np.ravel(C))[order]
+        chunk.risk = risk[order]
+
+        return self.merge(chunk)
+
+    #==========================================================================
+
+    def merge(self, other):
+
+        """ Add cases (and pairs) of another accumulator"""
+
+        assert other.prediction_type == self.prediction_type
+
+        T = np.concatenate((self.T, other.T))
+        C = np.concatenate((self.C, other.C))
+        risk = np.concatenate((self.risk, other.risk))
+        is_other = np.arange(len(T)) >= len(self.T)
+
+        observed = C == 0
+        censored = C == 1
+
+        # pairs across the two sets with longer time and lower risk
+        n_concordant = \
+            _count_concordant(T, C, risk, ~is_other, is_other) + \
+            _count_concordant(T, C, risk, is_other, ~is_other)
+
+        # observed pairs across the two sets with equal times and risks
+        n_tied = 0.
+        if np.any(observed):
+            _, group = np.unique(np.stack((T[observed], risk[observed])), 
+                                 axis=1, return_inverse=True)
+            group = np.ravel(group)
+            n_groups = np.max(group) + 1
+            n_tied = np.dot(\
+                    np.bincount(group[~is_other[observed]], minlength=n_groups),
+                    np.bincount(group[is_other[observed]], minlength=n_groups))
+
+        # orderable pairs across the two sets
+        n_orderable = \
+            np.sum(observed & ~is_other) * np.sum(observed & is_other)
+        for first, second in [(~is_other, is_other), (is_other, ~is_other)]:
+            n_orderable += np.sum(np.searchsorted(\
+                    np.sort(T[observed & first]), T[censored & second], 
+                    side='right'))
+
+        self.n_concordant += other.n_concordant + n_concordant + n_tied
+        self.n_orderable += other.n_orderable + n_orderable
+        self.n_tied += other.n_tied + n_tied
+
+        # keep cases sorted by descending time
+        order = np.argsort(-T, kind='mergesort')
+        self.T = T[order]
+        self.C = C[order]
+        self.risk = risk[order]
+
+        return self
+
+    #==========================================================================
+
+    def c_index(self):
+
+        """ Concordance index of all cases so far"""
+
+        if self.n_orderable == 0:
+            return 0
+
+        return self.n_concordant / self.n_orderable
+
+#==============================================================================
+
+def _get_risk(prediction, prediction_type = 'risk'):
+
+    """Risk of predictions of type 'risk' or 'survival_time'"""
+
+    if prediction_type == 'risk':
+        return prediction
+
+    elif prediction_type == 'survival_time':
+        # normalize
+        prediction = prediction / np.max(prediction)
+        # convert to risk
+        return 1 - prediction
+
+    raise ValueError("prediction_type is either 'risk' or 'survival_time'.")
+
+#==============================================================================
+
+# sort order of the last few sets of outcomes (see c_index_many)
+_outcome_order_cache = {}
+_OUTCOME_ORDER_CACHE_SIZE = 8
+
+def c_index_many(predictions, T, C, prediction_type = 'risk'):
+
+    """
+    Concordance index of many prediction vectors sharing the same 
+    outcomes (eg. one column per K, ensemble, or hyperparameter set). 
+    Same output as c_index for each column, but the sort order, 
+    observed cases and no of orderable pairs of (T, C) are found once 
+    (and cached for later calls with the same outcomes); each column 
+    then only needs its risk ranks and the O(n log n) Fenwick count.
+
+    Args:
+    -----
+    predictions - (N,) or (N, M) np array of predicted risk/survival time
+    T - (N,) time of death or last follow up
+    C - (N,) censored status
+    prediction_type - either 'risk' or 'survival_time'
+
+    Returns:
+    --------
+    cis - (M,) np array of c-indices
+    """
+
+    predictions = np.asarray(predictions)
+    if predictions.ndim == 1:
+        predictions = predictions[:, None]
+
+    outcomes = _get_outcome_order(T, C)
+    cis = np.zeros([predictions.shape[1]])
+
+    if outcomes['n_orderable'] == 0:
+        return cis
+
+    order = outcomes['order']
+    T = outcomes['T']
+    C = outcomes['C']
+    observed = outcomes['observed']
+    everyone = np.ones(len(T), dtype=np.bool_)
+
+    counts = jUtils.concordant_counts if jUtils.USE_NUMBA \
+        else jUtils._concordant_counts
+
+    for m in range(predictions.shape[1]):
+
+        risk = np.float64(np.ravel(\
+                _get_risk(predictions[:, m], prediction_type)))[order]
+
+        # observed cases with longer time and lower risk
+        risk_ranks, risk_rank = np.unique(risk, return_inverse=True)
+        score = counts(T, C, np.int64(np.ravel(risk_rank)), len(risk_ranks),
+                       everyone, everyone)
+
+        # observed pairs with equal times and equal risks
+        _, n_tied = np.unique(np.stack((T[observed], risk[observed])), 
+                              axis=1, return_counts=True)
+        score += np.sum(n_tied * (n_tied - 1) / 2)
+
+        cis[m] = score / outcomes['n_orderable']
+
+    return cis
+
+#==============================================================================
+
+def _get_outcome_order(T, C):
+
+    """
+    Outcomes sorted by descending time, as needed by the Fenwick count 
+    of c_index (cached by outcomes):
+    'order' - sorting indices
+    'T', 'C', 'observed' - sorted times, censored status, observed mask
+    'n_orderable' - no of orderable pairs
+    """
+
+    T = np.float64(np.ravel(T))
+    C = np.int64(np.ravel(C))
+
+    key = (T.tobytes(), C.tobytes())
+    if key in _outcome_order_cache:
+        return _outcome_order_cache[key]
+
+    observed = C == 0
+    censored = C == 1
+
+    n_observed = np.sum(observed)
+    n_orderable = n_observed * (n_observed - 1) / 2 + \
+        np.sum(np.searchsorted(np.sort(T[observed]), T[censored], 
+                               side='right'))
+
+    order = np.argsort(-T, kind='mergesort')
+
+    outcomes = {'order': order,
+                'T': T[order],
+                'C': C[order],
+                'observed': observed[order],
+                'n_orderable': n_orderable,
+                }
+
+    if len(_outcome_order_cache) >= _OUTCOME_ORDER_CACHE_SIZE:
+        _outcome_order_cache.pop(next(iter(_outcome_order_cache)))
+    _outcome_order_cache[key] = outcomes
+
+    return outcomes
+
+#==============================================================================
+
+# max no of elements of pair matrices built at once by c_index_bootstrap
+PAIR_CHUNK_ELEMENTS = 2 ** 24
+
+def c_index_bootstrap(prediction, T, C, n_boot = 1000, 
+                      prediction_type = 'risk', seed = None):
+
+    """
+    Concordance index of bootstrap resamples of (prediction, T, C), 
+    eg. to get a confidence interval by percentiles of the output.
+    Each resample is expressed as multiplicity weights W of cases, so 
+    its no of concordant (orderable) pairs is a weighted pair sum
+    sum_ij W_i * A_ij * W_j, where A marks the concordant (orderable) 
+    pairs. A is built once, in blocks of rows (observed cases), and all 
+    resamples are scored together by matrix products. Same output as 
+    c_index of each resample, where copies of an observed case are 
+    tied orderable (and concordant) pairs.
+
+    NOTE: For prediction_type = 'survival_time', risk is normalized 
+    by the max over all cases (not over each resample).
+
+    Args:
+    -----
+    prediction - (N,) np array of predicted risk/survival time
+    T - (N,) time of death or last follow up
+    C - (N,) censored status
+    n_boot - no of bootstrap resamples
+    prediction_type - either 'risk' or 'survival_time'
+    seed - random seed of resampling
+
+    Returns:
+    --------
+    cis - (n_boot,) np array of c-indices
+    """
+
+    risk = np.float64(np.ravel(_get_risk(np.ravel(prediction), 
+                                         prediction_type)))
+    T = np.float64(np.ravel(T))
+    C = np.int64(np.ravel(C))
+    N = len(T)
+
+    observed = C == 0
+    censored = C == 1
+    known = observed | censored
+
+    # no of copies of each case in each resample
+    rng = np.random.RandomState(seed)
+    W = np.float64(rng.multinomial(N, np.ones(N) / N, size=n_boot))
+
+    # pairs of copies of the same observed case
+    n_self = np.sum(W[:, observed] * (W[:, observed] - 1) / 2, axis=1)
+    score = n_self.copy()
+    n_orderable = n_self.copy()
+
+    # pairs of observed case i (rows) and case j (columns)
+    rows = np.nonzero(observed)[0]
+    block = max(1, PAIR_CHUNK_ELEMENTS // max(N, 1))
+
+    for start in range(0, len(rows), block):
+
+        i = rows[start:start+block]
+
+        # j lives longer (any known status)
+        longer = known[None, :] & (T[None, :] > T[i, None])
+
+        # both observed with tied times (each pair is seen twice)
+        tied = observed[None, :] & (T[None, :] == T[i, None]) & \
+            (np.arange(N)[None, :] != i[:, None])
+
+        # j is censored with a tied time
+        tied_censored = censored[None, :] & (T[None, :] == T[i, None])
+
+        A_concordant = np.float64(longer & (risk[i, None] > risk[None, :])) + \
+            0.5 * (tied & (risk[i, None] == risk[None, :]))
+        A_orderable = np.float64(longer | tied_censored) + 0.5 * tied
+
+        score += np.sum(W[:, i] * np.dot(W, A_concordant.T), axis=1)
+        n_orderable += np.sum(W[:, i] * np.dot(W, A_orderable.T), axis=1)
+
+    return np.where(n_orderable > 0, score / np.maximum(n_orderable, 1), 0)
+
+#==============================================================================
+
+def c_index_reference(prediction, T, C, prediction_type = 'risk'):
     
     """
     Calculate concordance index to evaluate model prediction.
@@ -74,6 +601,8 @@ def c_index(prediction, T, C, prediction_type = 'risk'):
     Returns
     -------
     A value between 0 and 1 indicating concordance index. 
+
+    This is the O(n^2) reference implementation; see c_index.
     """
     
     if prediction_type == 'risk':
@@ -93,55 +622,61 @@ def c_index(prediction, T, C, prediction_type = 'risk'):
     n_orderable = 0.0
     score = 0.0
     
-    for i in range(len(T)):
-        for j in range(i+1,len(T)):
+    if jUtils.USE_NUMBA:
+        score, n_orderable = jUtils.c_index_counts(\
+                np.float64(np.ravel(risk)), np.float64(np.ravel(T)), 
+                np.int64(np.ravel(C)))
 
+    else:
+        for i in range(len(T)):
+            for j in range(i+1,len(T)):
 
-            # Case 1: both cases are observed
-            # =================================================================
 
-            if(C[i] == 0 and C[j] == 0):
+                # Case 1: both cases are observed
+                # =============================================================
 
-                # i and j are always orderable
-                n_orderable = n_orderable + 1
-                
-                if(T[i] > T[j]):
-                    if(risk[j] > risk[i]):
-                        score = score + 1
-                elif(T[j] > T[i]):
-                    if(risk[i] > risk[j]):
-                        score = score + 1
-                else:
-                    if(risk[i] == risk[j]):
-                        score = score + 1
-
-            # Case 2: i is censored while j is observed
-            # =================================================================
-
-            elif(C[i] == 1 and C[j] == 0):
-
-                if(T[i] >= T[j]):      
-                    
-                    # i and j only orderable if i lived longer
+                if(C[i] == 0 and C[j] == 0):
+
+                    # i and j are always orderable
                     n_orderable = n_orderable + 1
-                    
+                
                     if(T[i] > T[j]):
                         if(risk[j] > risk[i]):
                             score = score + 1
+                    elif(T[j] > T[i]):
+                        if(risk[i] > risk[j]):
+                            score = score + 1
+                    else:
+                        if(risk[i] == risk[j]):
+                            score = score + 1
 
-            # Case 3: i is observed while j is censored
-            # =================================================================
+                # Case 2: i is censored while j is observed
+                # =============================================================
 
-            elif(C[j] == 1 and C[i] == 0):
+                elif(C[i] == 1 and C[j] == 0):
 
-                if(T[j] >= T[i]):
+                    if(T[i] >= T[j]):      
                     
-                    # i and j only orderable if i lived longer
-                    n_orderable = n_orderable + 1
+                        # i and j only orderable if i lived longer
+                        n_orderable = n_orderable + 1
+                    
+                        if(T[i] > T[j]):
+                            if(risk[j] > risk[i]):
+                                score = score + 1
 
-                    if(T[j] > T[i]):
-                        if(risk[i] > risk[j]):
-                            score = score + 1
+                # Case 3: i is observed while j is censored
+                # =============================================================
+
+                elif(C[j] == 1 and C[i] == 0):
+
+                    if(T[j] >= T[i]):
+                    
+                        # i and j only orderable if i lived longer
+                        n_orderable = n_orderable + 1
+
+                        if(T[j] > T[i]):
+                            if(risk[i] > risk[j]):
+                                score = score + 1
     
     if n_orderable > 0:
         ci = score / n_orderable
@@ -185,7 +720,8 @@ def calc_at_risk(T, O, X = None):
     T = np.asarray(tmp).astype('float64')
     order = np.argsort(T)
     sorted_T = T[order]
-    at_risk = np.asarray([list(sorted_T).index(x) for x in sorted_T]).astype('int32')
+    # first index of each time (start of its risk group)
+    at_risk = np.searchsorted(sorted_T, sorted_T, side='left').astype('int32')
     T = np.asarray(sorted_T)
     O = O[order]
     
@@ -194,6 +730,59 @@ def calc_at_risk(T, O, X = None):
 
     return T, O, at_risk, X
 
+#==============================================================================
+
+def get_pij_mask(T, O, mask_type = 'at-risk', dtype = np.float64):
+    
+    """
+    Mask to be multiplied by Pij when training NCA, built by 
+    broadcasting over the patients sorted w.r.t. time of death 
+    (same sorting and risk groups as calc_at_risk). Only rows of 
+    observed patients are non-zero.
+
+    Args:
+    -----
+    T - (m,) time of death
+    O - (m,) observed status (1 - censoring status)
+    mask_type - one of:
+        "at-risk" - ones over the at-risk group of each patient
+        "observed" - |Ti - Tj| over observed patients
+    dtype - dtype of mask (eg. np.float32 to feed tensorflow, or 
+            np.bool_ for the "at-risk" mask)
+
+    Returns:
+    --------
+    order - (m,) indices sorting patients w.r.t. time of death
+    at_risk - (m,) int32 starting index of risk groups
+    Pij_mask - (m, m) mask, rows and columns in sorted order
+    """
+
+    T = np.float64(np.ravel(T))
+    order = np.argsort(T)
+    T = T[order]
+    O = np.ravel(O)[order] == 1
+
+    at_risk = np.searchsorted(T, T, side='left').astype('int32')
+
+    if mask_type == 'at-risk':
+        # only at-risk cases (unweighted)
+        Pij_mask = O[:, None] & \
+            (np.arange(len(T))[None, :] >= at_risk[:, None])
+        Pij_mask = Pij_mask.astype(dtype)
+
+    elif mask_type == 'observed':
+        # only observed cases (weighted by difference in outcomes)
+        if np.dtype(dtype) == np.bool_:
+            raise ValueError("The observed mask is weighted, dtype cannot be bool.")
+        T = T.astype(dtype)
+        Pij_mask = np.abs(T[None, :] - T[:, None])
+        Pij_mask *= O[:, None] & O[None, :]
+
+    else:
+        raise ValueError("mask_type is either 'at-risk' or 'observed'.")
+
+    return order, at_risk, Pij_mask
+
 
 #%%############################################################################
 #%%############################################################################
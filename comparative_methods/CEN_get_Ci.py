@@ -12,9 +12,9 @@ sys.path.append('/home/mohamed/Desktop/CooperLab_Research/KNN_Survival/Codes/')
 import numpy as np
 from pandas import DataFrame as df, read_table
 from scipy.io import loadmat
-import _pickle
 
 import SurvivalUtils as sUtils
+import DataManagement as dm
 
 #%%
 # Read predictions and outcomes
@@ -59,8 +59,7 @@ for site in ["GBMLGG", "KIPAN"]:
         Data = None
         
         # load split indices
-        with open(dpath.split('.mat')[0] + '_splitIdxs.pkl','rb') as f:
-                splitIdxs = _pickle.load(f)
+        splitIdxs = dm.load_split_idxs(dpath.split('.mat')[0] + '_splitIdxs')
         
         # Load file list
         pred_path = result_path + site + '_' + dtype + '/'
@@ -84,13 +83,11 @@ for site in ["GBMLGG", "KIPAN"]:
             preds_val = read_table(pred_path + val_files[foldidx_val], sep=' ')
             preds_test = read_table(pred_path + test_files[foldidx_test], sep=' ')
             
-            # Get validation set accuracy
-            ci_val = []
-            for hyperpars in range(preds_val.shape[1]):
-                ci_val.append(sUtils.c_index(preds_val.values[:, hyperpars], 
-                                             Survival[splitIdxs['valid'][fold]], 
-                                             Censored[splitIdxs['valid'][fold]], 
-                                             prediction_type = 'risk'))
+            # Get validation set accuracy (all hyperparams at once)
+            ci_val = sUtils.c_index_many(preds_val.values, 
+                                         Survival[splitIdxs['valid'][fold]], 
+                                         Censored[splitIdxs['valid'][fold]], 
+                                         prediction_type = 'risk')
                                              
             # Get testing set accuracy for optimal hyperparams
             ci_test.append(sUtils.c_index(preds_test.values[:, np.argmax(ci_val)], 
@@ -1,9 +1,13 @@
+import sys
 import numpy as np
 from scipy.io import savemat
 
 #basePath = "/home/mohamed/Desktop/CooperLab_Research/KNN_Survival/"
 basePath = "/home/mtageld/Desktop/KNN_Survival/"
 
+sys.path.append(basePath + 'Codes')
+import DataManagement as dm
+
 sites = ["GBMLGG", "BRCA", "KIPAN"]
 dtypes = ["Integ", "Gene"]
 
@@ -13,8 +17,8 @@ for site in sites:
         print(site + "\t" + dtype)
         
         dataPath = basePath + 'Data/SingleCancerDatasets/' + site + '/' + site + '_' + dtype + '_Preprocessed.mat'
-        splitIdxPath = dataPath.split('.mat')[0] + '_splitIdxs.pkl'
+        splitIdxPath = dataPath.split('.mat')[0] + '_splitIdxs'
         
-        splitIdxs = np.load(splitIdxPath)
+        splitIdxs = dm.load_split_idxs(splitIdxPath)
         
-        savemat(splitIdxPath.split('.pkl')[0] + '.mat', splitIdxs)
+        savemat(splitIdxPath + '.mat', splitIdxs)
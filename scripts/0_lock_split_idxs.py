@@ -11,7 +11,6 @@ import sys
 #sys.path.append('/home/mohamed/Desktop/CooperLab_Research/KNN_Survival/Codes')
 sys.path.append('/home/mtageld/Desktop/KNN_Survival/Codes')
 
-import _pickle
 from scipy.io import loadmat, savemat
 import numpy as np
 
@@ -62,12 +61,11 @@ def Preprocess_and_split(projectPath, site, dtype, \
     #====================================================
     
     savename_data = dpath.split('.mat')[0] + "_Preprocessed.mat"
-    savename_split = dpath.split('.mat')[0] + "_Preprocessed_splitIdxs.pkl"
+    savename_split = dpath.split('.mat')[0] + "_Preprocessed_splitIdxs.npz"
    
     savemat(savename_data, Data)
 
-    with open(savename_split,'wb') as f:
-        _pickle.dump(splitIdxs, f)
+    dm.save_split_idxs(splitIdxs, savename_split)
 
 
 # Peprocess all datasets
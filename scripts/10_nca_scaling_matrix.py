@@ -19,6 +19,7 @@ from bayes_opt import BayesianOptimization as bayesopt
 
 import NCA_model as nca
 import KNNSurvival as knn
+import DataManagement as dm
 from pandas import DataFrame as df
 
 #%% ===========================================================================
@@ -163,8 +164,7 @@ def get_cv_accuracy(dpath, site, dtype, description,
     #N = Features.shape[0]
 
     
-    with open(dpath.split('.mat')[0] + '_splitIdxs.pkl','rb') as f:
-        splitIdxs = _pickle.load(f)
+    splitIdxs = dm.load_split_idxs(dpath.split('.mat')[0] + '_splitIdxs')
     
     #
     # result structure
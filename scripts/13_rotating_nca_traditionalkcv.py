@@ -19,6 +19,7 @@ from bayes_opt import BayesianOptimization as bayesopt
 
 import NCA_model as nca
 import KNNSurvival as knn
+import DataManagement as dm
 from pandas import DataFrame as df
 
 #%% ===========================================================================
@@ -161,8 +162,7 @@ def get_cv_accuracy(dpath, site, dtype, description,
     Data = None
 
     
-    with open(dpath.split('.mat')[0] + '_splitIdxs.pkl','rb') as f:
-        splitIdxs = _pickle.load(f)
+    splitIdxs = dm.load_split_idxs(dpath.split('.mat')[0] + '_splitIdxs')
     
     #
     # result structure
@@ -376,7 +376,8 @@ def get_cv_accuracy(dpath, site, dtype, description,
         print("\nGetting accuracy.") 
         
         # combined training and validation sets
-        combinedIdxs = splitIdxs['train'][fold] + splitIdxs['valid'][fold]
+        combinedIdxs = np.concatenate((splitIdxs['train'][fold], 
+                                       splitIdxs['valid'][fold]))
         
         _, ci = knnmodel.predict_with_bagging(\
                     X_test=x_test,
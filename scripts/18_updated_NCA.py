@@ -21,6 +21,8 @@ from bayes_opt import BayesianOptimization as bayesopt
 
 import NCA_model as nca
 import KNNSurvival as knn
+import DataManagement as dm
+import NeighborUtils as nUtils
 from pandas import DataFrame as df
 
 #%% ===========================================================================
@@ -139,13 +141,13 @@ def get_cv_accuracy(dpath, site, dtype, description,
         
         numpc_max = np.min([feats_train.shape[1], 200])
         
-        for numpc in range(4, numpc_max, 4):
-            feats_train_new = feats_train[:, 0:numpc]
-            feats_valid_new = feats_valid[:, 0:numpc]
-            # get neighbor indices    
-            neighbor_idxs = knnmodel._get_neighbor_idxs(feats_valid_new, 
-                                                        feats_train_new, 
-                                                        norm = k_tune_params['norm'])
+        # get neighbor indices for all numpc's in one sweep over PC's
+        prefix_neighbors = nUtils.prefix_neighbor_idxs(\
+                feats_valid, feats_train, range(4, numpc_max, 4),
+                norm = k_tune_params['norm'],
+                K_max = k_tune_params['K_init'])
+        
+        for numpc, neighbor_idxs in prefix_neighbors:
             # Predict validation set
             _, Ci = knnmodel.predict(neighbor_idxs,
                                      Survival_train=T_train, 
@@ -188,8 +190,7 @@ def get_cv_accuracy(dpath, site, dtype, description,
         ncamodel.build_computational_graph(COMPUT_GRAPH_PARAMS=graphParams)
 
     
-    with open(dpath.split('.mat')[0] + '_splitIdxs.pkl','rb') as f:
-        splitIdxs = _pickle.load(f)
+    splitIdxs = dm.load_split_idxs(dpath.split('.mat')[0] + '_splitIdxs')
     
     # Go through folds, optimize and get accuracy
     #==========================================================================
@@ -384,24 +385,20 @@ def get_cv_accuracy(dpath, site, dtype, description,
                             x_valid, x_train, 
                             norm = k_tune_params['norm'])
     
+        # Predict validation set (all Ks at once)
+        _, CIs_k = knnmodel.predict_multi_k(\
+                             neighbor_idxs=neighbor_idxs,
+                             Survival_train=Survival[splitIdxs['train'][fold]],
+                             Censored_train=Censored[splitIdxs['train'][fold]],
+                             Survival_test=Survival[splitIdxs['valid'][fold]],
+                             Censored_test=Censored[splitIdxs['valid'][fold]],
+                             Ks=k_tune_params['Ks'],
+                             Method=k_tune_params['Method'])
+        
         print("\tK \t Ci")
         
-        CIs_k = np.zeros([len(k_tune_params['Ks'])])
         for kidx, K in enumerate(k_tune_params['Ks']):
-        
-            # Predict validation set
-            _, Ci = knnmodel.predict(\
-                                 neighbor_idxs=neighbor_idxs,
-                                 Survival_train=Survival[splitIdxs['train'][fold]],
-                                 Censored_train=Censored[splitIdxs['train'][fold]],
-                                 Survival_test=Survival[splitIdxs['valid'][fold]],
-                                 Censored_test=Censored[splitIdxs['valid'][fold]],
-                                 K=K,
-                                 Method=k_tune_params['Method'])
-        
-            CIs_k[kidx] = Ci
-        
-            print("\t{} \t {}".format(K, round(Ci, 3)))
+            print("\t{} \t {}".format(K, round(CIs_k[kidx], 3)))
             
         K_optim = k_tune_params['Ks'][np.argmax(CIs_k)]
         print("\nK_optim = {}".format(K_optim))
@@ -413,7 +410,8 @@ def get_cv_accuracy(dpath, site, dtype, description,
         print("\nGetting accuracy.") 
         
         # combined training and validation sets
-        combinedIdxs = splitIdxs['train'][fold] + splitIdxs['valid'][fold]
+        combinedIdxs = np.concatenate((splitIdxs['train'][fold], 
+                                       splitIdxs['valid'][fold]))
         
         if USE_BAGGING:
             _, ci = knnmodel.predict_with_bagging(\
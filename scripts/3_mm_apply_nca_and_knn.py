@@ -16,6 +16,7 @@ import numpy as np
 
 import NCA_model as nca
 import KNNSurvival as knn
+import DataManagement as dm
 
 def get_cv_accuracy(dpath, site, dtype, description,
                     RESULTPATH, 
@@ -56,8 +57,7 @@ def get_cv_accuracy(dpath, site, dtype, description,
     Survival = Data['Survival'].reshape([N,])
     Censored = Data['Censored'].reshape([N,])
 
-    with open(dpath.split('.mat')[0] + '_splitIdxs.pkl','rb') as f:
-        splitIdxs = _pickle.load(f)
+    splitIdxs = dm.load_split_idxs(dpath.split('.mat')[0] + '_splitIdxs')
 
     #
     # result structure
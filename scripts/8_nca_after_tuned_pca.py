@@ -18,6 +18,7 @@ from sklearn.decomposition import PCA
 
 import NCA_model_experimental as nca
 import KNNSurvival as knn
+import DataManagement as dm
 
 #%% ===========================================================================
 # Primary method - get cross validation accuracy
@@ -110,8 +111,7 @@ def get_cv_accuracy(dpath, site, dtype, description,
     Survival = Data['Survival'].reshape([N,])
     Censored = Data['Censored'].reshape([N,])
     
-    with open(dpath.split('.mat')[0] + '_splitIdxs.pkl','rb') as f:
-        splitIdxs = _pickle.load(f)
+    splitIdxs = dm.load_split_idxs(dpath.split('.mat')[0] + '_splitIdxs')
     
     #
     # result structure